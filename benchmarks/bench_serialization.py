@@ -0,0 +1,63 @@
+"""
+Serialization Benchmark
+
+Compares the two ways a page of the Product list can be turned into a
+response body, without touching the database:
+
+  marshal  - Product objects -> serialize() -> marshal(product_model) -> json
+  rows     - row tuples -> RowSerializer -> JSON bytes (the list fast path)
+
+  python -m benchmarks.bench_serialization --rows 10000
+"""
+import argparse
+import json
+import timeit
+
+from flask_restx import marshal
+from service.models import Product
+from service.routes import product_model, product_serializer, LIST_FIELDS
+from service.serializers import orjson
+
+
+def make_products(count):
+    """Returns count in-memory Products and the same data as row tuples"""
+    products = [
+        Product(id=n, name="product-{}".format(n), description="description of product {}".format(n),
+                price=n / 100.0, inventory=n % 100, owner="owner-{}".format(n % 1000),
+                category="category-{}".format(n % 50))
+        for n in range(count)
+    ]
+    rows = [tuple(getattr(product, field) for field in LIST_FIELDS) for product in products]
+    return products, rows
+
+
+def marshal_path(products):
+    """The original path of the list endpoint"""
+    results = [product.serialize() for product in products]
+    return json.dumps(marshal(results, product_model)).encode("utf-8")
+
+
+def rows_path(rows):
+    """The single pass path of the list endpoint"""
+    return product_serializer.dumps(rows)
+
+
+def run(count, repeat):
+    """Times both paths and checks that they produce the same documents"""
+    products, rows = make_products(count)
+    assert json.loads(marshal_path(products)) == json.loads(rows_path(rows))
+    print("Serializing {:,} products, best of {} runs (orjson {})".format(
+        count, repeat, "installed" if orjson else "not installed"))
+    baseline = None
+    for name, path, data in (("marshal", marshal_path, products), ("rows", rows_path, rows)):
+        best = min(timeit.repeat(lambda: path(data), number=1, repeat=repeat))
+        baseline = baseline or best
+        print("  {:<8}{:>10.2f}ms{:>8.1f}x".format(name, best * 1000, baseline / best))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="number of products per page")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each path")
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
@@ -18,3 +18,73 @@ if 'VCAP_SERVICES' in os.environ:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool, size it so workers * (size + overflow) stays under the
+# PostgreSQL max_connections (ignored for SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "yes", "1")
+
+# Admission control: a worker works on at most *_CONCURRENCY reads, writes
+# and purchases at once (0 turns the limit off), the next ones wait up to
+# *_QUEUE_TIMEOUT seconds for a slot and then get a 503 with Retry-After.
+# The limits are shares of the requests a worker can serve at once (its
+# threads or gevent worker_connections, WORKER_CONCURRENCY is set by
+# gunicon.conf.py) capped by the connection pool. Reads and writes together
+# always leave a slot free, so a purchase gets in when they are saturated;
+# purchases may use every slot and wait the longest
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+ADMISSION_CAPACITY = min(WORKER_CONCURRENCY, DB_POOL_SIZE + DB_MAX_OVERFLOW)
+WRITE_CONCURRENCY = int(os.getenv("WRITE_CONCURRENCY", str(max(1, ADMISSION_CAPACITY // 4))))
+WRITE_QUEUE_TIMEOUT = float(os.getenv("WRITE_QUEUE_TIMEOUT", "0.5"))
+READ_CONCURRENCY = int(os.getenv("READ_CONCURRENCY", str(max(1, ADMISSION_CAPACITY - 1 - WRITE_CONCURRENCY))))
+READ_QUEUE_TIMEOUT = float(os.getenv("READ_QUEUE_TIMEOUT", "0.05"))
+PURCHASE_CONCURRENCY = int(os.getenv("PURCHASE_CONCURRENCY", str(ADMISSION_CAPACITY)))
+PURCHASE_QUEUE_TIMEOUT = float(os.getenv("PURCHASE_QUEUE_TIMEOUT", "2"))
+RETRY_AFTER = int(os.getenv("RETRY_AFTER", "1"))
+
+# Per client rate limit of each worker: a token bucket that refills at
+# RATE_LIMIT requests a second up to RATE_LIMIT_BURST (0 turns it off)
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", "0"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+
+# Pagination limits for the list endpoint
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+MAX_FACET_BUCKETS = int(os.getenv("MAX_FACET_BUCKETS", "100"))
+
+# Number of rows fetched per round trip when streaming an export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Maximum number of Products accepted by a single batch create
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+
+# In-process cache of serialized Products; entries from other workers'
+# writes can be up to PRODUCT_CACHE_TTL seconds stale (size 0 disables it)
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "1024"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30"))
+
+# API key for the protected endpoints such as the CSV import, unset denies them
+API_KEY = os.getenv("API_KEY")
+
+# Rejected rows of a CSV import that are reported line by line
+IMPORT_MAX_REJECTS = int(os.getenv("IMPORT_MAX_REJECTS", "1000"))
+
+# Per request SQL statistics: the X-Query-Count and Server-Timing headers are
+# sent when EXPOSE_QUERY_STATS is set or the app runs in debug or testing mode,
+# and a warning is logged when a request issues more than QUERY_BUDGET
+# statements or repeats one statement N_PLUS_ONE_THRESHOLD times. Streamed
+# responses (the exports) get neither, their queries run after the headers
+EXPOSE_QUERY_STATS = os.getenv("EXPOSE_QUERY_STATS", "false").lower() in ("true", "yes", "1")
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "10"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+# Logging: records are written by a background thread from a queue of
+# LOG_QUEUE_SIZE records, dropped and counted when it is full. LOG_FORMAT is
+# json or text, and LOG_SAMPLE_RATE keeps the info logs of that fraction of
+# the requests (warnings and errors are always kept)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
@@ -38,17 +38,19 @@ def step_impl(context):
         context.resp = requests.delete(context.base_url + '/products/' + str(product["id"]), headers=headers)
         expect(context.resp.status_code).to_equal(204)
     
-    # load the database with new products
-    create_url = context.base_url + '/products'
-    for row in context.table:
-        data = {
+    # load the database with new products in a single batch
+    create_url = context.base_url + '/products:batch'
+    data = [
+        {
             "name": row['name'],
             "description": row['description'],
             "price": float(row['price']),
             "inventory": int(row['inventory']),
             "owner": row['owner'],
             "category": row['category']
-            }
-        payload = json.dumps(data)
-        context.resp = requests.post(create_url, data=payload, headers=headers)
-        expect(context.resp.status_code).to_equal(201)
+        }
+        for row in context.table
+    ]
+    payload = json.dumps(data)
+    context.resp = requests.post(create_url, data=payload, headers=headers)
+    expect(context.resp.status_code).to_equal(201)
@@ -1,6 +1,99 @@
+"""
+Gunicorn configuration for the Product Service
+
+Pick a worker profile with GUNICORN_PROFILE:
+
+  sync     - one request per process, CPU bound work and the simplest model
+  gthread  - a few threads per process, the default, good for DB bound reads
+  gevent   - green threads, many slow or idle connections per process
+
+The app is preloaded in the master, so every worker drops the database
+connections it inherited when it is forked, then opens its own before it
+takes its first request. The schema is not touched here, run the
+migrations first. Metrics are kept in files shared by the workers so
+/metrics reports all of them.
+
+  flask upgrade-db
+  gunicorn --config gunicon.conf.py "service:create_app()"
+"""
+import multiprocessing
 import os
+import shutil
+import tempfile
+
+PROFILE = os.getenv("GUNICORN_PROFILE", "gthread")
+CORES = multiprocessing.cpu_count()
+
+if PROFILE == "gevent":
+    # patch before the app and psycopg2 are imported by preload_app so the
+    # pool locks and the database sockets cooperate with the event loop
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+PROFILES = {
+    "sync": {"worker_class": "sync", "workers": 2 * CORES + 1, "threads": 1, "pool_size": 1},
+    "gthread": {"worker_class": "gthread", "workers": CORES + 1, "threads": 4, "pool_size": 4},
+    "gevent": {"worker_class": "gevent", "workers": CORES, "threads": 1, "pool_size": 20},
+}
+settings = PROFILES[PROFILE]
 
 PORT = os.getenv("PORT", "5000")
 bind = "0.0.0.0:" + PORT
-workers = 1
-log_level = "info"
\ No newline at end of file
+worker_class = settings["worker_class"]
+workers = int(os.getenv("WEB_CONCURRENCY", str(settings["workers"])))
+threads = int(os.getenv("GUNICORN_THREADS", str(settings["threads"])))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "200"))
+preload_app = True
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then, jittered so they do not all restart at once
+max_requests = 2000
+max_requests_jitter = 200
+# the heartbeat file lives in memory, a disk backed /tmp can stall workers
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+loglevel = os.getenv("LOG_LEVEL", "info")
+errorlog = "-"
+
+# one pooled connection per concurrent request in each worker, and the
+# requests a worker serves at once for admission control, read by config.py
+# when preload_app imports the service
+os.environ.setdefault("DB_POOL_SIZE", str(settings["pool_size"]))
+os.environ.setdefault("WORKER_CONCURRENCY", str(worker_connections if worker_class == "gevent" else threads))
+
+# every worker writes its Prometheus metrics to files in this directory and
+# /metrics merges them, it is emptied when the master starts; this file is
+# read again on every reload (SIGHUP), so it only makes sure it exists
+METRICS_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "product-metrics"),
+)
+os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+def on_starting(server):
+    """ Drops the metrics of an earlier run, once per master """
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+
+
+def post_fork(server, worker):
+    """ Drops the connections the worker inherited from the master """
+    from service.models import Product
+    with worker.app.wsgi().app_context():
+        Product.dispose_engine()
+
+
+def post_worker_init(worker):
+    """ Warms the worker up so its first request is as fast as the rest """
+    from service.models import Product
+    with worker.wsgi.app_context():
+        Product.warm_up()
+
+
+def child_exit(server, worker):
+    """ Drops the live gauges of a worker that exited """
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,32 @@
+"""create the product table
+
+Revision ID: 1f6a2d9c4b83
+Revises: 
+Create Date: 2026-10-18 16:02:44.918305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1f6a2d9c4b83'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the table the first revisions were written against, it used to be
+    # made by db.create_all() when the service started
+    op.execute(sa.schema.CreateSequence(sa.Sequence('product_id_seq')))
+    op.create_table('product',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=63), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('product')
+    op.execute(sa.schema.DropSequence(sa.Sequence('product_id_seq')))
@@ -1,7 +1,7 @@
 """empty message
 
 Revision ID: 42acf788914b
-Revises: 
+Revises: 1f6a2d9c4b83
 Create Date: 2021-07-02 00:25:51.430409
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = '42acf788914b'
-down_revision = None
+down_revision = '1f6a2d9c4b83'
 branch_labels = None
 depends_on = None
 
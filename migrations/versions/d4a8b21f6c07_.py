@@ -0,0 +1,30 @@
+"""add full-text search vector to product
+
+Revision ID: d4a8b21f6c07
+Revises: 9c3f1e7a2b64
+Create Date: 2026-10-18 11:03:52.640117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8b21f6c07'
+down_revision = '9c3f1e7a2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # generated columns need PostgreSQL 12 or later
+    op.execute(
+        "ALTER TABLE product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+        "(to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, ''))) STORED"
+    )
+    op.create_index('ix_product_search_vector', 'product', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_product_search_vector', table_name='product')
+    op.drop_column('product', 'search_vector')
@@ -3,42 +3,63 @@ Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
+
+Importing the package has no side effects, the app is built by create_app():
+
+  gunicorn --config=gunicon.conf.py "service:create_app()"
+
+service.app is still there for code that imports it, it is created the
+first time it is used
 """
-import os
 import sys
-import logging
+import click
 from flask import Flask
 
-# Create Flask application
-app = Flask(__name__)
-app.config.from_object("config")
-
-# Import the rutes After the Flask app is created
-from service import routes, models, error_handlers
-
-# Set up logging for production
-if __name__ != "__main__":
-    gunicorn_logger = logging.getLogger("gunicorn.error")
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
-    app.logger.propagate = False
-    # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
-    )
-    for handler in app.logger.handlers:
-        handler.setFormatter(formatter)
-    app.logger.info("Logging handler established")
-
-app.logger.info(70 * "*")
-app.logger.info("  M Y   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
-
-try:
-    routes.init_db()  # make our sqlalchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
-
-app.logger.info("Service inititalized!")
\ No newline at end of file
+
+def create_app(config="config"):
+    """ Creates and configures the Flask app
+
+    Nothing here connects to the database, the engine and its pool are
+    made by the first request that uses them. The schema is managed by
+    the migrations (flask upgrade-db), never when the app starts.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    # Import the rutes After the Flask app is created
+    from service import routes, models, error_handlers, metrics, admission, commands, logs
+
+    routes.init_app(app)
+    error_handlers.init_app(app)
+    metrics.init_app(app)
+    admission.init_app(app)
+    commands.init_app(app)
+    if click.get_current_context(silent=True) is not None:
+        # only the flask db commands need Alembic, workers do not load it
+        models.init_migrations(app)
+
+    # Set up logging for production
+    logs.init_app(app)
+
+    app.logger.info(70 * "*")
+    app.logger.info("  M Y   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
+
+    try:
+        routes.init_db(app)  # bind sqlalchemy to the app
+    except Exception as error:
+        app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+
+    app.logger.info("Service inititalized!")
+    return app
+
+
+def __getattr__(name):
+    """ Creates the default app the first time service.app is used """
+    if name == "app":
+        global app  # pylint: disable=global-variable-undefined,invalid-name
+        app = create_app()
+        return app
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
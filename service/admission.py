@@ -0,0 +1,166 @@
+"""
+Admission Control for the Service
+Bounds the requests a worker works on at once so that a slow database makes
+the service shed load instead of piling every request up in the connection
+pool. Reads, writes and purchases each have their own slots, so list scans
+can never take the connections purchases need, and every client has a token
+bucket that limits its request rate.
+
+  over the concurrency limit of its class  - 503 with Retry-After
+  over the rate limit of its client        - 429 with Retry-After
+"""
+import hmac
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from .metrics import ADMISSION_IN_FLIGHT, ADMISSION_REJECTED, ADMISSION_WAIT, resource_name
+
+# the Resources whose requests are purchases, every other request is a read
+# or a write by its method
+PURCHASE_RESOURCES = ("PurchaseResource", "CheckoutResource")
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class ConcurrencyLimiter():
+    """
+    Lets at most limit requests in at once, the next ones wait up to
+    queue_timeout seconds for a slot
+    """
+
+    def __init__(self, name, limit, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def acquire(self):
+        """ Takes a slot, returns False when none was free in time """
+        start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        ADMISSION_WAIT.labels(self.name).observe(time.perf_counter() - start)
+        if acquired:
+            ADMISSION_IN_FLIGHT.labels(self.name).inc()
+        return acquired
+
+    def release(self):
+        """ Gives a slot back """
+        ADMISSION_IN_FLIGHT.labels(self.name).dec()
+        self._slots.release()
+
+
+class TokenBuckets():
+    """
+    A token bucket per client that fills at rate tokens a second up to burst
+
+    The least recently seen clients are forgotten past max_clients, their
+    buckets would be full again by the time they come back anyway
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+
+    def take(self, client):
+        """ Takes a token of the client, returns 0 or the seconds until it has one """
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class Admission():
+    """ The limiters of an app, built from its config """
+
+    def __init__(self, config):
+        self.retry_after = config["RETRY_AFTER"]
+        self.limiters = {
+            name: ConcurrencyLimiter(name, config[prefix + "_CONCURRENCY"], config[prefix + "_QUEUE_TIMEOUT"])
+            for name, prefix in (("reads", "READ"), ("writes", "WRITE"), ("purchases", "PURCHASE"))
+            if config[prefix + "_CONCURRENCY"] > 0
+        }
+        self.buckets = None
+        if config["RATE_LIMIT"] > 0:
+            self.buckets = TokenBuckets(config["RATE_LIMIT"], config["RATE_LIMIT_BURST"])
+
+
+def request_class():
+    """ Returns reads, writes or purchases, or None for the requests that are not limited """
+    if request.url_rule is None:
+        return None
+    # only the REST API, /metrics and the docs must answer under load
+    view = current_app.view_functions[request.endpoint]
+    if not hasattr(view, "view_class"):
+        return None
+    if resource_name() in PURCHASE_RESOURCES:
+        return "purchases"
+    if request.method in READ_METHODS:
+        return "reads"
+    return "writes"
+
+
+def client_id():
+    """ Returns who the request counts against, the API key or its address
+
+    Only the configured API key names a client, any other key would let a
+    client start a new bucket on every request
+    """
+    api_key = current_app.config.get("API_KEY")
+    token = request.headers.get("X-Api-Key")
+    if api_key and token and hmac.compare_digest(token.encode("utf-8"), api_key.encode("utf-8")):
+        return "api-key"
+    return request.remote_addr
+
+
+def admit():
+    """ Turns the request away if its client or its class is over the limit """
+    name = request_class()
+    if name is None:
+        return
+    admission = current_app.extensions["admission"]
+    if admission.buckets is not None:
+        wait = admission.buckets.take(client_id())
+        if wait:
+            ADMISSION_REJECTED.labels(name, "rate").inc()
+            current_app.logger.warning("Rate limit exceeded by %s", client_id())
+            raise TooManyRequests("Too many requests, slow down", retry_after=math.ceil(wait))
+    limiter = admission.limiters.get(name)
+    if limiter is None:
+        return
+    if not limiter.acquire():
+        ADMISSION_REJECTED.labels(name, "concurrency").inc()
+        current_app.logger.warning("Shedding %s: %d %s in flight", request.path, limiter.limit, name)
+        raise ServiceUnavailable(
+            "The service is busy, try again later", retry_after=admission.retry_after
+        )
+    g.admission_limiter = limiter
+
+
+def release(error=None):  # pylint: disable=unused-argument
+    """ Gives the slot of the request back when it is torn down """
+    limiter = g.pop("admission_limiter", None)
+    if limiter is not None:
+        limiter.release()
+
+
+def init_app(app):
+    """ Limits the requests of the app by class and by client """
+    app.extensions["admission"] = Admission(app.config)
+    app.before_request(admit)
+    app.teardown_request(release)
@@ -0,0 +1,96 @@
+"""
+Cache for Product
+A bounded in-process cache that keeps serialized Products in the worker
+so that hot reads do not have to go back to the database
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache():
+    """
+    A thread safe least recently used cache whose entries expire
+
+    Entries live for at most ttl seconds, which also bounds how stale a
+    worker can be about writes that were made by other workers
+    """
+
+    def __init__(self, maxsize=1024, ttl=30.0):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, maxsize, ttl):
+        """ Resizes the cache and empties it """
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def stamp(self):
+        """ Returns a token to pass to set() after a miss is loaded """
+        return self._generation
+
+    def get(self, key):
+        """ Returns the cached value for key or None on a miss """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, stamp=None):
+        """
+        Caches value under key
+
+        When stamp is given the value is only cached if nothing was
+        invalidated since stamp() was called, so a slow read can never
+        put back data that a concurrent write just replaced
+        """
+        with self._lock:
+            if self.maxsize <= 0 or (stamp is not None and stamp != self._generation):
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """ Removes keys from the cache """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """ Removes every entry from the cache """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns the size of the cache and its hit, miss and eviction counters """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
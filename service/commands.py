@@ -0,0 +1,129 @@
+"""
+Commands for the Service
+Flask CLI commands for maintaining the product catalog
+
+  flask upgrade-db
+  flask create-tables
+  flask import-products catalog.csv --upsert
+  flask export-products catalog.csv.gz --gzip --category fruit
+"""
+import gzip
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from service.models import db, Product, _is_postgresql
+from service.routes import generate_csv
+
+# the revision of the tables db.create_all() made before the migrations
+# managed the schema: the newest revision that added a column or an index
+# the product table has, the first migrated revision otherwise
+CREATE_ALL_REVISIONS = (
+    ("5e0b7c9d1a28", "version"),
+    ("d4a8b21f6c07", "search_vector"),
+    ("9c3f1e7a2b64", "ix_product_name"),
+)
+CREATE_ALL_BASELINE = "42acf788914b"
+
+# key of the PostgreSQL advisory lock that lets one instance migrate at a time
+MIGRATION_LOCK = 4242
+
+
+######################################################################
+# UPGRADE THE DATABASE
+######################################################################
+def create_all_revision(connection):
+    """ Returns the revision of tables that no migration has stamped, or None """
+    inspector = inspect(connection)
+    tables = inspector.get_table_names()
+    if "product" not in tables or "alembic_version" in tables:
+        return None
+    names = {column["name"] for column in inspector.get_columns("product")}
+    names.update(index["name"] for index in inspector.get_indexes("product"))
+    for revision, name in CREATE_ALL_REVISIONS:
+        if name in names:
+            return revision
+    return CREATE_ALL_BASELINE
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db():
+    """ Runs the migrations, stamping tables made by db.create_all() first """
+    from flask_migrate import stamp, upgrade  # pylint: disable=import-outside-toplevel
+    with db.engine.connect() as connection:
+        # every instance runs this as it starts, the others wait here
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), key=MIGRATION_LOCK)
+        try:
+            revision = create_all_revision(connection)
+            if revision is not None:
+                click.echo("Stamping the existing tables with revision {}".format(revision))
+                stamp(revision=revision)
+            upgrade()
+        finally:
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), key=MIGRATION_LOCK)
+    click.echo("Database upgraded")
+
+
+######################################################################
+# CREATE THE TABLES
+######################################################################
+@click.command("create-tables")
+@with_appcontext
+def create_tables():
+    """ Creates the database tables that do not exist yet """
+    Product.create_tables()
+    click.echo("Tables created")
+
+
+######################################################################
+# IMPORT PRODUCTS FROM CSV
+######################################################################
+@click.command("import-products")
+@with_appcontext
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--upsert", is_flag=True, help="Update the Products with the same name and owner")
+def import_products(path, upsert):
+    """ Imports Products from a CSV file with a header row of the Product fields """
+    with open(path, encoding="utf-8", newline="") as lines:
+        report = Product.import_csv(lines, upsert, current_app.config["IMPORT_MAX_REJECTS"])
+    for rejected in report["rejected"]:
+        click.echo("line {line}: {message}".format(**rejected), err=True)
+    click.echo("Imported {inserted} new and {updated} updated Products, skipped {duplicates} repeated rows, "
+               "rejected {rejected_count} rows".format(**report))
+    if report["rejected_count"]:
+        raise SystemExit(1)
+
+
+######################################################################
+# EXPORT PRODUCTS TO CSV
+######################################################################
+@click.command("export-products")
+@with_appcontext
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--gzip", "compress", is_flag=True, help="Compress the file with gzip")
+@click.option("--name", "names", multiple=True, help="Export Products by name (repeat for any of several)")
+@click.option("--owner", "owners", multiple=True, help="Export Products by owner (repeat for any of several)")
+@click.option("--category", "categories", multiple=True, help="Export Products by category (repeat for any of several)")
+@click.option("--low", type=float, help="Export Products by min price")
+@click.option("--high", type=float, help="Export Products by max price")
+def export_products(path, compress, names, owners, categories, low, high):
+    """ Exports the Products that match the filters to a CSV file """
+    query = Product.find_by_filters(list(names), list(owners), list(categories), low, high)
+    with (gzip.open(path, "wb") if compress else open(path, "wb")) as out:
+        if _is_postgresql():
+            Product.copy_csv(query, out)
+        else:
+            for chunk in generate_csv(Product.stream_all(current_app.config["EXPORT_BATCH_SIZE"], query)):
+                out.write(chunk.encode("utf-8"))
+    click.echo("Exported Products to {}".format(path))
+
+
+def init_app(app):
+    """ Adds the catalog commands to the flask command of the app """
+    app.cli.add_command(upgrade_db)
+    app.cli.add_command(create_tables)
+    app.cli.add_command(import_products)
+    app.cli.add_command(export_products)
@@ -1,9 +1,10 @@
-from flask import jsonify
+from flask import jsonify, current_app
 from service.models import DataValidationError
-from . import app, status
+from . import status
 from .routes import api
 from flask_api import status  # HTTP Status Codes
-from service.routes import api
+from service.routes import api, NotModified
+from werkzeug.http import quote_etag
 
 ######################################################################
 # Error Handlers
@@ -14,14 +15,19 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@api.errorhandler(NotModified)
+def not_modified(error):
+    """ Answers a conditional GET when the client's copy is still current """
+    return {}, status.HTTP_304_NOT_MODIFIED, {"ETag": quote_etag(error.etag)}
+
+
 ######################################################################
 # Special Error Handlers
 ######################################################################
-@app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """ Handles Value Errors from bad data """
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return {
         'status_code': status.HTTP_400_BAD_REQUEST,
         'error': 'Bad Request',
@@ -29,11 +35,10 @@ def bad_request(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
-@app.errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """ Handles resources not found with 404_NOT_FOUND """
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return {
         'status': 'status.HTTP_404_NOT_FOUND',
         'error': 'Not Found',
@@ -41,10 +46,9 @@ def not_found(error):
     }, status.HTTP_404_NOT_FOUND
 
 
-@app.errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)
 def method_not_supported(error):
     """ Handles unsuppoted HTTP methods with 405_METHOD_NOT_SUPPORTED """
-    app.logger.warning(str(error))
+    current_app.logger.warning(str(error))
     return {
         'status': 'status.HTTP_405_METHOD_NOT_ALLOWED',
         'error': 'Method not Allowed',
@@ -52,11 +56,10 @@ def method_not_supported(error):
     }, status.HTTP_405_METHOD_NOT_ALLOWED
 
 
-@app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """ Handles Value Errors from bad data """
     message = str(error)
-    app.logger.error(message)
+    current_app.logger.error(message)
     return {
         'status_code': status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         'error': 'Unsupported media type',
@@ -64,12 +67,20 @@ def mediatype_not_supported(error):
     }, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
   
 
-@app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """ Handles unexpected server error with 500_SERVER_ERROR """
-    app.logger.error(str(error))
+    current_app.logger.error(str(error))
     return {
         'status': 'status.HTTP_500_INTERNAL_SERVER_ERROR,',
         'error': '"Internal Server Error",',
         'message': 'str(error),',
     }, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def init_app(app):
+    """ Answers the HTTP errors of the app with JSON """
+    app.register_error_handler(status.HTTP_400_BAD_REQUEST, bad_request)
+    app.register_error_handler(status.HTTP_404_NOT_FOUND, not_found)
+    app.register_error_handler(status.HTTP_405_METHOD_NOT_ALLOWED, method_not_supported)
+    app.register_error_handler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, mediatype_not_supported)
+    app.register_error_handler(status.HTTP_500_INTERNAL_SERVER_ERROR, internal_server_error)
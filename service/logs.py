@@ -0,0 +1,187 @@
+"""
+Logging for the Service
+Log records are handed to a bounded queue and written out by a background
+thread, so a slow stdout never slows a request down. When the queue is full
+records are dropped and counted instead of blocking the worker.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+from .metrics import LOG_RECORDS_DROPPED
+
+# the logger of the models, the app logs to app.logger
+MODELS_LOGGER = "flask.app"
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats a record as one line of JSON """
+
+    # added to the records of requests by RequestFilter
+    REQUEST_FIELDS = ("method", "path")
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for field in self.REQUEST_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestFilter(logging.Filter):
+    """
+    Adds the method and path of the request to its log records, and keeps
+    the info logs of only a sample of the requests
+
+    A request is sampled as a whole, so the info logs that are kept tell the
+    full story of the request. Warnings and errors are always kept.
+    """
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        record.method = request.method
+        record.path = request.path
+        if record.levelno > logging.INFO or self.sample_rate >= 1:
+            return True
+        if "log_sampled" not in g:
+            g.log_sampled = random.random() < self.sample_rate
+        return g.log_sampled
+
+
+class DroppingQueueHandler(QueueHandler):
+    """ A QueueHandler that drops and counts the records a full queue has no room for """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def prepare(self, record):
+        """ Merges the arguments into the message, the listener thread only sees text """
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class DrainingQueueListener(QueueListener):
+    """ A QueueListener that waits for room in a full queue to stop """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class QueueLogging():
+    """
+    Writes the records of some loggers to a stream from a background thread
+
+    The listener thread does not survive a fork, so a forked gunicorn worker
+    starts its own with a new queue
+    """
+
+    def __init__(self, handler, maxsize=10000, sample_rate=1.0):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.queue_handler = DroppingQueueHandler(queue.Queue(maxsize))
+        self.queue_handler.addFilter(RequestFilter(sample_rate))
+        self.listener = None
+
+    def start(self):
+        """ Starts the thread that writes the queued records """
+        self.listener = DrainingQueueListener(self.queue_handler.queue, self.handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """ Writes the records still queued and stops the thread """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart_in_child(self):
+        """ Replaces the queue and the thread the parent had when the process forked """
+        self.queue_handler.queue = queue.Queue(self.maxsize)
+        self.queue_handler.dropped = 0
+        self.listener = None
+        self.start()
+
+
+# the logging of the process, replaced when the app is configured again
+queue_logging = None
+
+
+def _restart_after_fork():
+    if queue_logging is not None:
+        queue_logging.restart_in_child()
+
+
+def _stop_at_exit():
+    if queue_logging is not None:
+        queue_logging.stop()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(_stop_at_exit)
+
+
+def init_app(app, level=None, stream=None):
+    """ Sends the logs of the app and of the models through a bounded queue
+
+    Args:
+        app (Flask): the app whose logger is configured
+        level (int): the lowest level logged, LOG_LEVEL by default
+        stream (file): where the records are written, stdout by default
+    """
+    global queue_logging  # pylint: disable=global-statement,invalid-name
+    config = app.config
+    level = level if level is not None else logging.getLevelName(config["LOG_LEVEL"])
+    handler = logging.StreamHandler(stream or sys.stdout)
+    if config["LOG_FORMAT"] == "json":
+        handler.setFormatter(JsonFormatter(datefmt=DATE_FORMAT))
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+    handler.setLevel(level)
+    _stop_at_exit()
+    queue_logging = QueueLogging(handler, config["LOG_QUEUE_SIZE"], config["LOG_SAMPLE_RATE"])
+    queue_logging.start()
+    for logger in (app.logger, logging.getLogger(MODELS_LOGGER)):
+        logger.handlers = [queue_logging.queue_handler]
+        logger.setLevel(level)
+        logger.propagate = False
+    app.logger.info("Logging handler established")
+    return queue_logging
@@ -0,0 +1,241 @@
+"""
+Metrics for the Service
+Prometheus metrics and the instrumentation that feeds them
+"""
+import os
+import time
+from collections import Counter as StatementCounter
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# latency buckets in seconds, from a cached read to a slow bulk request
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+######################################################################
+#  R E Q U E S T S
+######################################################################
+REQUESTS = Counter(
+    "http_requests", "Requests handled, by resource, method and status",
+    ["resource", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to build the response, by resource and method",
+    ["resource", "method"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds", "Time spent executing SQL statements in a request, by resource",
+    ["resource"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements", "SQL statements executed in a request, by resource",
+    ["resource"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+REQUEST_SERIALIZATION_TIME = Histogram(
+    "http_request_serialization_seconds", "Time spent encoding the response body, by resource",
+    ["resource"], buckets=LATENCY_BUCKETS,
+)
+
+# records the logging queue had no room for, see service/logs.py
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped", "Log records dropped because the logging queue was full"
+)
+
+# admission control, see service/admission.py
+ADMISSION_REJECTED = Counter(
+    "admission_rejected", "Requests turned away, by request class and reason",
+    ["request_class", "reason"],
+)
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds", "Time requests waited for a slot, by request class",
+    ["request_class"], buckets=LATENCY_BUCKETS,
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight", "Requests holding a slot, by request class",
+    ["request_class"], multiprocess_mode="livesum",
+)
+
+# durations in ms of the Server-Timing header, shown by browser dev tools
+SERVER_TIMING = 'db;desc="SQL";dur={:.2f}, serialize;dur={:.2f}, app;dur={:.2f}'
+
+
+def resource_name():
+    """ Returns the name of the flask_restx Resource, or the view, that handles the request """
+    if request.url_rule is None:
+        return "unmatched"
+    view = current_app.view_functions[request.endpoint]
+    return getattr(view, "view_class", view).__name__
+
+
+def start_request():
+    """ Starts the clocks of a request """
+    g.metrics_start = time.perf_counter()
+    g.db_time = 0.0
+    g.serialization_time = 0.0
+    g.statements = StatementCounter()
+
+
+def finish_request(response):
+    """ Records the latency, status and time breakdown of a request """
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    query_count = sum(g.statements.values())
+    resource = resource_name()
+    REQUESTS.labels(resource, request.method, response.status_code).inc()
+    REQUEST_LATENCY.labels(resource, request.method).observe(elapsed)
+    if response.is_streamed:
+        # a streamed body queries and serializes after this runs, so the
+        # counts so far would be too low; leave them out rather than mislead
+        return response
+    REQUEST_DB_TIME.labels(resource).observe(g.db_time)
+    REQUEST_DB_STATEMENTS.labels(resource).observe(query_count)
+    REQUEST_SERIALIZATION_TIME.labels(resource).observe(g.serialization_time)
+    check_query_budget(query_count)
+    if current_app.config["EXPOSE_QUERY_STATS"] or current_app.debug or current_app.testing:
+        response.headers["X-Query-Count"] = str(query_count)
+        response.headers["Server-Timing"] = SERVER_TIMING.format(
+            g.db_time * 1000, g.serialization_time * 1000, elapsed * 1000
+        )
+    return response
+
+
+def check_query_budget(query_count):
+    """ Warns about requests that issue too many or repeated SQL statements """
+    config = current_app.config
+    if query_count > config["QUERY_BUDGET"]:
+        current_app.logger.warning(
+            "%s %s issued %d SQL statements, over the budget of %d",
+            request.method, request.path, query_count, config["QUERY_BUDGET"],
+        )
+    statement, repeats = next(iter(g.statements.most_common(1)), (None, 0))
+    if repeats >= config["N_PLUS_ONE_THRESHOLD"]:
+        current_app.logger.warning(
+            "%s %s ran the same SQL statement %d times, possible N+1 query: %s",
+            request.method, request.path, repeats, " ".join(statement.split())[:200],
+        )
+
+
+@contextmanager
+def serialization_timer():
+    """ Adds the time spent in the block to the serialization time of the request """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and "serialization_time" in g:
+            g.serialization_time += time.perf_counter() - start
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """ Notes when a statement was sent to the database """
+    conn.info["query_start"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """ Adds the statement and the time it took to the SQL statistics of the request """
+    start = conn.info.pop("query_start", None)
+    if start is not None and has_request_context() and "statements" in g:
+        g.db_time += time.perf_counter() - start
+        g.statements[statement] += 1
+
+
+def metrics_view():
+    """ Prometheus metrics of the service, merged across gunicorn workers """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """ Records metrics for every request of the app and serves them on /metrics """
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+######################################################################
+#  C O N N E C T I O N   P O O L
+######################################################################
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts", "Connection checkouts that gave up after the pool timeout"
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections currently checked out of the pool",
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Connections open beyond the pool size",
+    multiprocess_mode="livesum",
+)
+POOL_SIZE = Gauge(
+    "db_pool_size", "Configured size of the connection pool",
+    multiprocess_mode="livesum",
+)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that records checkout waits, timeouts and occupancy
+
+    The wait covers the time spent blocked on a full pool plus the time
+    to open a new connection when the pool has room to grow
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+        self._record_occupancy()
+        return connection
+
+    def _do_return_conn(self, conn):
+        super()._do_return_conn(conn)
+        self._record_occupancy()
+
+    def dispose(self):
+        super().dispose()
+        for gauge in (POOL_SIZE, POOL_CHECKED_OUT, POOL_OVERFLOW):
+            gauge.set(0)
+
+    def _record_occupancy(self):
+        POOL_SIZE.set(self.size())
+        POOL_CHECKED_OUT.set(self.checkedout())
+        POOL_OVERFLOW.set(max(self.overflow(), 0))
+
+
+def pool_options(config):
+    """Returns the SQLAlchemy engine options for the configured connection pool"""
+    if config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        # SQLite connections are not pooled the same way, keep its defaults
+        return {}
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
@@ -3,19 +3,51 @@ Models for Product
 All of the models are stored in this module
 """
 import logging
+import hashlib
+import csv
+import io
+import math
+import queue
+import threading
+from itertools import islice
 #import uuid
+from datetime import datetime
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from . import app
+from .cache import LRUCache
+from .metrics import pool_options
 
-from sqlalchemy import func
-from sqlalchemy.exc import InvalidRequestError, DataError
+from sqlalchemy import DDL, Integer, and_, bindparam, cast, column, event, func, select, table, text
+from sqlalchemy.exc import InvalidRequestError, DataError, SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
 
 logger = logging.getLogger("flask.app")
 
+# Serialized Products by id, sized from the config in init_db()
+product_cache = LRUCache()
+
+# The public fields of a Product in serialization order
+PRODUCT_FIELDS = ("id", "name", "description", "price", "inventory", "owner", "category")
+
+# The fields a Product is created from, the columns of an imported CSV file
+IMPORT_FIELDS = PRODUCT_FIELDS[1:]
+
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
-migrate = Migrate(app, db)
+
+
+def init_migrations(app):
+    """ Registers the migrations of the models for the flask db commands
+
+    Alembic is imported here so that a worker serving requests never loads it
+    """
+    from flask_migrate import Migrate  # pylint: disable=import-outside-toplevel
+    Migrate(app, db)
+
+def _is_postgresql():
+    """Returns True when the bound database supports PostgreSQL only features"""
+    return db.engine.dialect.name == "postgresql"
+
 
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
@@ -23,6 +55,80 @@ class DataValidationError(Exception):
     pass
 
 
+class ExportCancelled(Exception):
+    """ Used to stop a COPY TO whose reader has gone away """
+
+
+class QueueWriter():
+    """
+    A write-only binary file that hands what is written to a queue in chunks
+
+    COPY TO writes one row at a time, grouping them keeps the queue and
+    thread switches per chunk rather than per row
+    """
+
+    def __init__(self, chunks, stopped, chunk_size=65536):
+        self.chunks = chunks
+        self.stopped = stopped
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        """ Buffers data and hands over a chunk once there is enough """
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ Hands over whatever is buffered """
+        if self.buffer:
+            self.put(b"".join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+    def put(self, item):
+        """ Waits for room in the queue unless the reader has stopped """
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise ExportCancelled("the export was cancelled")
+
+
+class CSVStream():
+    """
+    A read-only file of CSV text produced from an iterator of rows
+
+    COPY FROM STDIN pulls from it chunk by chunk, so rows are encoded as
+    they are validated and the whole file is never held in memory. Every
+    field is quoted, COPY reads an unquoted empty field as NULL
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, quoting=csv.QUOTE_ALL)
+
+    def read(self, size=8192):
+        """ Returns at least size characters of CSV, or "" once the rows run out """
+        for row in self.rows:
+            self.writer.writerow(row)
+            if self.buffer.tell() >= size:
+                break
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def readline(self, size=-1):
+        """ Returns CSV text, psycopg2 only needs read() but checks for both """
+        return self.read(8192 if size < 0 else size)
+
+
 class Product(db.Model):
     """
     Class that represents a <your resource model name>
@@ -32,12 +138,23 @@ class Product(db.Model):
 
     # Table Schema
     id = db.Column(db.Integer, db.Sequence('product_id_seq'), primary_key=True)
-    name = db.Column(db.String(63), nullable=False)
+    name = db.Column(db.String(63), nullable=False, index=True)
     description = db.Column(db.String(128), nullable=False)
-    price = db.Column(db.FLOAT(8))
+    price = db.Column(db.FLOAT(8), index=True)
     inventory = db.Column(db.Integer)
-    owner = db.Column(db.String(63))
+    owner = db.Column(db.String(63), index=True)
     category =  db.Column(db.String(63))
+    # the server defaults match migration 5e0b7c9d1a28 for raw INSERTs
+    version = db.Column(db.Integer, nullable=False, default=1, server_default=text("1"))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=func.now())
+
+    # category lookups use the leading column of the composite index
+    __table_args__ = (
+        db.Index('ix_product_category_price', 'category', 'price'),
+    )
+    # bump version on every ORM update
+    __mapper_args__ = {"version_id_col": version}
 
 
     def __repr__(self):
@@ -51,6 +168,272 @@ class Product(db.Model):
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
         db.session.commit()
+        product_cache.invalidate(self.id)
+
+    @classmethod
+    def create_many(cls, products, chunk_size=1000):
+        """
+        Creates many Products in a single transaction
+        Args:
+            products (list): the deserialized Products to insert
+            chunk_size (int): the number of rows per multi-row INSERT
+        """
+        logger.info("Creating %d Products", len(products))
+        if not products:
+            return
+        try:
+            if _is_postgresql():
+                # reserve all of the ids up front so each multi-row INSERT
+                # maps back to its Products without relying on RETURNING order
+                result = db.session.execute(
+                    text("SELECT nextval('product_id_seq') FROM generate_series(1, :count)"),
+                    {"count": len(products)},
+                )
+                for product, (new_id,) in zip(products, result):
+                    product.id = new_id
+                rows = [{field: getattr(product, field) for field in PRODUCT_FIELDS} for product in products]
+                for start in range(0, len(rows), chunk_size):
+                    db.session.execute(cls.__table__.insert().values(rows[start:start + chunk_size]))
+            else:
+                for product in products:
+                    product.id = None
+                db.session.add_all(products)
+                db.session.flush()
+                # detach so the new ids survive the commit without a reload per row
+                for product in products:
+                    db.session.expunge(product)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        product_cache.invalidate(*[product.id for product in products])
+
+    @classmethod
+    def import_csv(cls, lines, upsert=False, max_rejects=1000, chunk_size=1000):
+        """
+        Imports Products from CSV text in a single transaction
+        Args:
+            lines (iterable): the lines of a CSV file with a header row
+            upsert (bool): update the Products that have the same name and owner
+            max_rejects (int): the number of rejected rows to report in detail
+            chunk_size (int): the number of rows per executemany when COPY is not available
+        Returns:
+            dict: the inserted and updated counts, the rows left out because
+            a later row has the same name and owner, and the rejected rows
+        """
+        logger.info("Importing Products from CSV (upsert=%s)", upsert)
+        reader = csv.DictReader(lines)
+        missing = [field for field in IMPORT_FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            raise DataValidationError("Invalid CSV: missing columns " + ", ".join(missing))
+        report = {"inserted": 0, "updated": 0, "duplicates": 0, "rejected_count": 0, "rejected": []}
+
+        def valid_rows():
+            # validate while COPY or executemany consumes the rows
+            for row in reader:
+                try:
+                    yield cls.validate_csv_row(row)
+                except DataValidationError as error:
+                    report["rejected_count"] += 1
+                    if len(report["rejected"]) < max_rejects:
+                        report["rejected"].append({"line": reader.line_num, "message": str(error)})
+
+        try:
+            if _is_postgresql():
+                cls._copy_rows(valid_rows(), upsert, report)
+            else:
+                cls._executemany_rows(valid_rows(), upsert, report, chunk_size)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        product_cache.clear()
+        logger.info("Imported %d new and %d updated Products, skipped %d repeated rows, rejected %d rows",
+                    report["inserted"], report["updated"], report["duplicates"], report["rejected_count"])
+        return report
+
+    @classmethod
+    def _copy_rows(cls, rows, upsert, report):
+        """Loads validated rows with COPY FROM STDIN on PostgreSQL"""
+        # COPY cannot draw ids from the sequence or upsert, so it fills a
+        # staging table that is merged into product with set based statements
+        db.session.execute(text(
+            "CREATE TEMP TABLE product_import (line serial, name varchar(63), description varchar(128), "
+            "price float, inventory integer, owner varchar(63), category varchar(63)) ON COMMIT DROP"
+        ))
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            "COPY product_import ({}) FROM STDIN WITH (FORMAT csv)".format(", ".join(IMPORT_FIELDS)),
+            CSVStream([row[field] for field in IMPORT_FIELDS] for row in rows),
+        )
+        fields = ", ".join(IMPORT_FIELDS)
+        # in upsert mode the last row of the file wins when a name and owner repeat
+        source = "product_import AS i"
+        if upsert:
+            source = (
+                "(SELECT DISTINCT ON (name, owner) * FROM product_import "
+                "ORDER BY name, owner, line DESC) AS i"
+            )
+            report["duplicates"] = db.session.execute(text(
+                "SELECT count(*) - count(DISTINCT (name, owner)) FROM product_import"
+            )).scalar()
+            report["updated"] = db.session.execute(text(
+                "UPDATE product AS p SET description = i.description, price = i.price, "
+                "inventory = i.inventory, category = i.category, version = p.version + 1, "
+                "updated_at = :now FROM " + source + " WHERE p.name = i.name AND p.owner = i.owner"
+            ), {"now": datetime.utcnow()}).rowcount
+            source += " WHERE NOT EXISTS (SELECT 1 FROM product AS p WHERE p.name = i.name AND p.owner = i.owner)"
+        report["inserted"] = db.session.execute(text(
+            "INSERT INTO product (id, {0}, version, updated_at) "
+            "SELECT nextval('product_id_seq'), {0}, 1, :now FROM {1} ORDER BY i.line".format(fields, source)
+        ), {"now": datetime.utcnow()}).rowcount
+
+    @classmethod
+    def _executemany_rows(cls, rows, upsert, report, chunk_size):
+        """Loads validated rows with batched executemany where COPY is not available"""
+        table = cls.__table__
+        update = (
+            table.update()
+            .where(and_(table.c.name == bindparam("match_name"), table.c.owner == bindparam("match_owner")))
+            .values(version=table.c.version + 1)
+        )
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                return
+            inserts = batch
+            if upsert:
+                # the last row of the batch wins when a name and owner repeat
+                latest = {(row["name"], row["owner"]): row for row in batch}
+                report["duplicates"] += len(batch) - len(latest)
+                # look up by name alone so the name index is used
+                existing = set(tuple(key) for key in db.session.execute(
+                    select([table.c.name, table.c.owner]).where(
+                        table.c.name.in_({name for name, _ in latest}))
+                ))
+                inserts = [row for key, row in latest.items() if key not in existing]
+                updates = [
+                    dict(row, match_name=row["name"], match_owner=row["owner"])
+                    for key, row in latest.items() if key in existing
+                ]
+                if updates:
+                    report["updated"] += db.session.execute(update, updates).rowcount
+            if inserts:
+                db.session.execute(table.insert(), inserts)
+                report["inserted"] += len(inserts)
+
+    @classmethod
+    def _take_inventory(cls, by_id, amount):
+        """Returns a conditional UPDATE that only succeeds if amount is in stock"""
+        # a single statement so concurrent purchases can never oversell
+        table = cls.__table__
+        return (
+            table.update()
+            .where(table.c.id == by_id)
+            .where(table.c.inventory >= amount)
+            .values(inventory=table.c.inventory - amount, version=table.c.version + 1)
+        )
+
+    @classmethod
+    def purchase(cls, by_id, amount):
+        """
+        Atomically takes an amount out of a Product's inventory
+        Args:
+            by_id (int): the id of the Product to purchase
+            amount (int): the number of units to take out of inventory
+        Returns:
+            dict: the purchased Product's fields, or None when the Product
+            does not exist or has less than amount in inventory
+        """
+        logger.info("Processing purchase of %s for id %s ...", amount, by_id)
+        return cls._update_returning(by_id, cls._take_inventory(by_id, amount))
+
+    @classmethod
+    def update_if_version(cls, by_id, data, version):
+        """
+        Updates a Product only if it is still at the given version
+        Args:
+            by_id (int): the id of the Product to update
+            data (dict): the new fields of the Product
+            version (int): the version the caller last saw
+        Returns:
+            dict: the updated Product's fields, or None when the Product
+            does not exist or is no longer at that version
+        """
+        logger.info("Processing update of id %s at version %s ...", by_id, version)
+        product = cls().deserialize(data)
+        table = cls.__table__
+        values = {field: getattr(product, field) for field in PRODUCT_FIELDS[1:]}
+        statement = (
+            table.update()
+            .where(table.c.id == by_id)
+            .where(table.c.version == version)
+            .values(version=table.c.version + 1, **values)
+        )
+        return cls._update_returning(by_id, statement)
+
+    @classmethod
+    def _update_returning(cls, by_id, statement):
+        """Runs an UPDATE of one Product and commits it
+        Returns:
+            dict: the updated Product's fields, or None if no row was updated
+        """
+        fields = PRODUCT_FIELDS + ("version",)
+        table = cls.__table__
+        columns = [table.c[field] for field in fields]
+        if _is_postgresql():
+            row = db.session.execute(statement.returning(*columns)).first()
+        else:
+            row = None
+            if db.session.execute(statement).rowcount == 1:
+                row = db.session.execute(select(columns).where(table.c.id == by_id)).first()
+        db.session.commit()
+        product_cache.invalidate(by_id)
+        return dict(zip(fields, row)) if row else None
+
+    @classmethod
+    def checkout(cls, lines):
+        """
+        Purchases several Products together in a single transaction
+        Args:
+            lines (list): (id, amount) pairs of the Products to purchase
+        Returns:
+            list: a result dict per line, with the HTTP status of the line and
+            the inventory left; nothing is purchased unless every line can be
+        """
+        logger.info("Processing checkout of %d lines ...", len(lines))
+        totals = {}
+        for by_id, amount in lines:
+            totals[by_id] = totals.get(by_id, 0) + amount
+        # update (and so lock) the rows in ascending id order so that
+        # overlapping carts can't deadlock each other
+        short = set()
+        for by_id in sorted(totals):
+            if db.session.execute(cls._take_inventory(by_id, totals[by_id])).rowcount != 1:
+                short.add(by_id)
+        if short:
+            db.session.rollback()
+        table = cls.__table__
+        inventory = dict(
+            db.session.execute(
+                select([table.c.id, table.c.inventory]).where(table.c.id.in_(totals))
+            ).fetchall()
+        )
+        db.session.commit()
+        if not short:
+            product_cache.invalidate(*totals)
+        results = []
+        for by_id, amount in lines:
+            if by_id not in inventory:
+                line_status = 404
+            elif by_id in short:
+                line_status = 409
+            elif short:
+                line_status = 424
+            else:
+                line_status = 200
+            results.append({"id": by_id, "amount": amount, "status": line_status, "inventory": inventory.get(by_id)})
+        return results
 
     def update(self):
         """
@@ -62,6 +445,7 @@ class Product(db.Model):
             logger.info("empty ID")
             raise DataValidationError("empty ID")
         db.session.commit()
+        product_cache.invalidate(self.id)
 
     def delete(self):
         """ Removes a Product from the data store """
@@ -71,6 +455,7 @@ class Product(db.Model):
             db.session.commit()
         except InvalidRequestError:
             db.session.rollback()
+        product_cache.invalidate(self.id)
 
     def serialize(self):
         """ Serializes a Product into a dictionary """
@@ -81,7 +466,8 @@ class Product(db.Model):
             "price": self.price,
             "inventory": self.inventory,
             "owner": self.owner,
-            "category": self.category
+            "category": self.category,
+            "version": self.version
 
             }
 
@@ -91,13 +477,19 @@ class Product(db.Model):
         Args:
             data (dict): A dictionary containing the resource data
         """
+        for field, value in self.validate(data).items():
+            setattr(self, field, value)
+        return self
+
+    @staticmethod
+    def validate(data):
+        """
+        Returns the fields of a Product from a dictionary
+        Args:
+            data (dict): A dictionary containing the resource data
+        """
         try:
-            self.name = data["name"]
-            self.description = data["description"]
-            self.price = data["price"]
-            self.inventory = data["inventory"]
-            self.owner = data["owner"]
-            self.category = data["category"]
+            return {field: data[field] for field in IMPORT_FIELDS}
         except KeyError as error:
             raise DataValidationError(
                 "Invalid Product: missing " + error.args[0]
@@ -106,30 +498,213 @@ class Product(db.Model):
             raise DataValidationError(
                 "Invalid Product: body of request contained bad or no data"
             )
-        return self
+
+    @classmethod
+    def validate_csv_row(cls, row):
+        """
+        Returns the fields of a Product from a row of a CSV file
+
+        Applies the rules of deserialize() and also converts the numbers
+        and checks the columns, so COPY never fails on a bad row
+        Args:
+            row (dict): A row read by csv.DictReader
+        """
+        data = cls.validate(row)
+        for field in ("name", "description", "owner", "category"):
+            if data[field] is None:
+                raise DataValidationError("Invalid Product: missing " + field)
+            if not data[field].strip() and not cls.__table__.c[field].nullable:
+                raise DataValidationError("Invalid Product: {} is blank".format(field))
+        try:
+            data["price"] = float(data["price"])
+            data["inventory"] = int(data["inventory"])
+        except (TypeError, ValueError):
+            raise DataValidationError(
+                "Invalid Product: price must be a number and inventory an integer"
+            )
+        return cls.validate_columns(data)
+
+    @classmethod
+    def validate_columns(cls, data):
+        """
+        Returns the fields of a Product once they fit its columns
+
+        Checks the text lengths and the number ranges, so one bad Product
+        is rejected on its own instead of failing a whole batch insert
+        Args:
+            data (dict): the fields of a Product, numbers already converted
+        """
+        for field in ("name", "description", "owner", "category"):
+            length = cls.__table__.c[field].type.length
+            if data[field] is not None and len(data[field]) > length:
+                raise DataValidationError(
+                    "Invalid Product: {} is longer than {} characters".format(field, length)
+                )
+        inventory, price = data["inventory"], data["price"]
+        if (inventory is not None and not -2 ** 31 <= inventory < 2 ** 31) or (
+                price is not None and not math.isfinite(price)):
+            raise DataValidationError("Invalid Product: price or inventory is out of range")
+        return data
 
     @classmethod
     def init_db(cls, app):
         """ Initializes the database session """
         logger.info("Initializing database")
         cls.app = app
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = pool_options(app.config)
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
-        app.app_context().push()
+        product_cache.configure(app.config["PRODUCT_CACHE_SIZE"], app.config["PRODUCT_CACHE_TTL"])
+
+    @classmethod
+    def create_tables(cls):
+        """ Creates the tables that do not exist yet
+
+        For development and tests on SQLite, deployed databases are
+        managed by the migrations (flask upgrade-db)
+        """
+        logger.info("Creating database tables")
         db.create_all()  # make our sqlalchemy tables
 
+    @classmethod
+    def dispose_engine(cls):
+        """ Drops the pooled connections, a forked worker must not share them """
+        logger.info("Disposing database engine")
+        db.engine.dispose()
+        product_cache.clear()
+
+    @classmethod
+    def warm_up(cls):
+        """ Does the one-time work of a new worker before it takes requests
+
+        Configures the mappers and opens the first pooled connection, so the
+        first request is not the slowest. A database that cannot be reached
+        yet is left to the first request rather than failing the worker.
+        """
+        configure_mappers()
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except SQLAlchemyError as error:
+            logger.warning("Database not reachable while warming up: %s", error)
+
     @classmethod
     def all(cls):
         """ Returns all of the Products in the database """
         logger.info("Processing all Products")
         return cls.query.all()
 
+    @classmethod
+    def stream_all(cls, batch_size=1000, query=None):
+        """Returns an iterator of Product field tuples fetched in batches
+        Args:
+            batch_size (int): the number of rows fetched per round trip
+            query (Query): the Product query to stream, all Products by default
+        """
+        logger.info("Streaming all Products in batches of %s", batch_size)
+        return cls.select_fields(query or cls.query).order_by(cls.id).yield_per(batch_size)
+
+    @classmethod
+    def copy_csv(cls, query, out):
+        """Writes the Products of a query as CSV with a header row using COPY TO
+        PostgreSQL only, the rows never become Python objects
+        Args:
+            query (Query): the Product query to export
+            out (file): a binary file that COPY writes the UTF-8 CSV to
+        """
+        logger.info("Copying Products to CSV")
+        statement = cls.select_fields(query).order_by(cls.id).statement.compile(dialect=db.engine.dialect)
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            # COPY takes no parameters, so psycopg2 quotes them into the statement
+            select_sql = cursor.mogrify(str(statement), statement.params).decode("utf-8")
+            cursor.copy_expert("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)".format(select_sql), out)
+            connection.commit()
+        except Exception:
+            # a COPY cut short leaves the connection mid protocol
+            connection.invalidate()
+            raise
+        finally:
+            connection.close()
+
+    @classmethod
+    def stream_csv(cls, query, chunk_size=65536):
+        """Returns an iterator of UTF-8 CSV chunks of the Products of a query
+        COPY TO runs in a thread that hands over chunks through a bounded
+        queue, so a slow client slows the database read instead of the
+        worker buffering the whole export
+        Args:
+            query (Query): the Product query to export
+            chunk_size (int): the number of characters per chunk
+        """
+        chunks = queue.Queue(maxsize=8)
+        stopped = threading.Event()
+        out = QueueWriter(chunks, stopped, chunk_size)
+        app_context = current_app.app_context()
+
+        def produce():
+            with app_context:
+                try:
+                    cls.copy_csv(query, out)
+                    out.flush()
+                    last = None
+                except ExportCancelled:
+                    return
+                except Exception as error:  # pylint: disable=broad-except
+                    last = error
+                try:
+                    out.put(last)
+                except ExportCancelled:
+                    pass
+
+        def consume():
+            producer = threading.Thread(target=produce, daemon=True)
+            producer.start()
+            try:
+                while True:
+                    chunk = chunks.get()
+                    if chunk is None:
+                        return
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    yield chunk
+            finally:
+                # the client went away or the export ended, stop COPY either way
+                stopped.set()
+                producer.join()
+
+        return consume()
+
+    @classmethod
+    def select_fields(cls, query, fields=PRODUCT_FIELDS):
+        """Returns a Product query that yields tuples of just the given fields
+        Args:
+            query (Query): the Product query to project
+            fields (tuple): the names of the Product fields to select
+        """
+        return query.with_entities(*[getattr(cls, field) for field in fields])
+
     @classmethod
     def find(cls, by_id):
         """ Finds a Product by it's ID """
         logger.info("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
+    @classmethod
+    def find_serialized(cls, by_id):
+        """ Finds a serialized Product by it's ID, from the cache when it can """
+        data = product_cache.get(by_id)
+        if data is not None:
+            return data
+        stamp = product_cache.stamp()
+        product = cls.find(by_id)
+        if not product:
+            return None
+        data = product.serialize()
+        product_cache.set(by_id, data, stamp)
+        return data
+
     @classmethod
     def find_or_404(cls, by_id):
         """ Find a Product by it's id """
@@ -171,3 +746,175 @@ class Product(db.Model):
         """
         logger.info("Processing category query for %s ...", category)
         return cls.query.filter(cls.category == category)
+
+    @classmethod
+    def find_by_filters(cls, names=None, owners=None, categories=None, low=None, high=None):
+        """Returns all Products that match every one of the given filters
+        Args:
+            names (list): the names of the Products you want to match
+            owners (list): the owners of the Products you want to match
+            categories (list): the categories of the Products you want to match
+            low (float): the minimum price of the Products you want to match
+            high (float): the maximum price of the Products you want to match
+        """
+        logger.info(
+            "Processing filter query for names %s owners %s categories %s price %s to %s ...",
+            names, owners, categories, low, high,
+        )
+        query = cls.query
+        # most selective predicates first; category is followed by the price
+        # range so together they match the (category, price) index
+        for column, values in ((cls.name, names), (cls.owner, owners), (cls.category, categories)):
+            if values:
+                query = query.filter(column.in_(values) if len(values) > 1 else column == values[0])
+        if low is not None:
+            query = query.filter(cls.price >= low)
+        if high is not None:
+            query = query.filter(cls.price <= high)
+        return query
+
+    @classmethod
+    def search(cls, query, terms):
+        """Returns the Products of a query that match a full-text search
+        best matches first
+        Args:
+            query (Query): the Product query to search within
+            terms (string): the words to search for in name and description
+        """
+        logger.info("Processing full-text search for %s ...", terms)
+        if _is_postgresql():
+            tsquery = func.plainto_tsquery("english", terms)
+            vector = column("search_vector")
+            return query.filter(vector.op("@@")(tsquery)).order_by(
+                func.ts_rank(vector, tsquery).desc(), cls.id
+            )
+        # quote every word so FTS5 treats the terms as plain text
+        phrase = " ".join('"{}"'.format(word.replace('"', '""')) for word in terms.split())
+        fts = table("product_fts", column("rowid"))
+        return (
+            query.join(fts, fts.c.rowid == cls.id)
+            .filter(text("product_fts MATCH :terms").bindparams(terms=phrase))
+            .order_by(text("bm25(product_fts)"), cls.id)
+        )
+
+    @classmethod
+    def facets(cls, query, buckets=10, limit=20):
+        """Returns counts and price statistics of the Products in a query
+        Args:
+            query (Query): the Product query to summarize
+            buckets (int): the number of equal width price histogram buckets
+            limit (int): the most category and owner values to count
+        """
+        logger.info("Processing facets in %s buckets ...", buckets)
+        query = query.order_by(None)
+        count, low, high, average = query.with_entities(
+            func.count(cls.id), func.min(cls.price), func.max(cls.price), func.avg(cls.price)
+        ).one()
+        facets = {
+            "count": count,
+            "price": {"min": low, "max": high, "avg": float(average) if average is not None else None},
+            "histogram": [],
+        }
+        for name, field in (("categories", cls.category), ("owners", cls.owner)):
+            counts = (
+                query.with_entities(field, func.count(cls.id))
+                .group_by(field)
+                .order_by(func.count(cls.id).desc(), field)
+                .limit(limit)
+            )
+            facets[name] = [{"value": value, "count": total} for value, total in counts]
+        if low is None:
+            return facets
+        width = (high - low) / buckets
+        if width == 0:
+            bucket = cast(0, Integer)
+        elif _is_postgresql():
+            # width_bucket puts the maximum price in bucket buckets + 1
+            bucket = func.least(func.width_bucket(cls.price, low, high, buckets), buckets) - 1
+        else:
+            bucket = func.min(cast((cls.price - low) / width, Integer), buckets - 1)
+        totals = dict(
+            query.filter(cls.price.isnot(None))
+            .with_entities(bucket, func.count(cls.id))
+            .group_by(bucket)
+        )
+        for index in range(buckets if width else 1):
+            facets["histogram"].append({
+                "low": low + index * width,
+                "high": low + (index + 1) * width if width else high,
+                "count": totals.get(index, 0),
+            })
+        return facets
+
+    @staticmethod
+    def fingerprint(rows):
+        """Returns a digest that changes whenever any of the rows is written
+        Every write bumps the version, so only the rows of a page are read
+        rather than the whole filtered set
+        Args:
+            rows (list): Product rows with id and version columns
+        """
+        digest = hashlib.sha1()
+        for row in rows:
+            digest.update("{}-{};".format(row.id, row.version).encode("ascii"))
+        return digest.hexdigest()
+
+    @classmethod
+    def paginate(cls, query, last_id=None, limit=None):
+        """Returns one keyset page of a Product query ordered by id
+        Args:
+            query (Query): the Product query to page through
+            last_id (int): the id of the last Product on the previous page
+            limit (int): the maximum number of Products to return
+        """
+        logger.info("Processing page after id %s (limit %s) ...", last_id, limit)
+        if last_id is not None:
+            query = query.filter(cls.id > last_id)
+        return query.order_by(cls.id).limit(limit).all()
+
+
+######################################################################
+#  F U L L - T E X T   S E A R C H
+######################################################################
+# PostgreSQL keeps a generated tsvector column with a GIN index on it,
+# other databases (SQLite for local runs) use an FTS5 table kept in step
+# by triggers; both are maintained by the database on every write
+FULL_TEXT_DDL = {
+    "postgresql": [
+        "ALTER TABLE product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+        "(to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, ''))) STORED",
+        "CREATE INDEX ix_product_search_vector ON product USING GIN (search_vector)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE product_fts USING fts5(name, description, "
+        "content='product', content_rowid='id', tokenize='porter unicode61')",
+        "CREATE TRIGGER product_fts_insert AFTER INSERT ON product BEGIN "
+        "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+        "CREATE TRIGGER product_fts_delete AFTER DELETE ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); END",
+        "CREATE TRIGGER product_fts_update AFTER UPDATE OF name, description ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    ],
+}
+
+for dialect, statements in FULL_TEXT_DDL.items():
+    for statement in statements:
+        event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect=dialect))
+event.listen(
+    Product.__table__, "before_drop", DDL("DROP TABLE IF EXISTS product_fts").execute_if(dialect="sqlite")
+)
+
+# names of the objects above, FTS5 adds product_fts_data and the like
+FULL_TEXT_OBJECTS = ("search_vector", "ix_product_search_vector", "product_fts")
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """ Tells alembic autogenerate to leave the full-text objects alone
+
+    They are not in the metadata, so without this every `flask db migrate`
+    would write a migration that drops them
+    """
+    return not (reflected and compare_to is None and name.startswith(FULL_TEXT_OBJECTS))
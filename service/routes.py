@@ -5,48 +5,72 @@ Describe what your service does here
 """
 
 import os
-import sys
 import logging
-from flask import Flask, jsonify, request, url_for, make_response, abort
+from flask import Flask, current_app, jsonify, request, url_for, make_response, abort, Response, stream_with_context
 
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
 from flask_sqlalchemy import SQLAlchemy
-from service.models import Product, DataValidationError
-from werkzeug.exceptions import NotFound
+from service.models import db, Product, DataValidationError, PRODUCT_FIELDS, _is_postgresql
+from service.serializers import EncodedBody, RowSerializer, dumps, gzip_chunks
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import NotFound, HTTPException
+from werkzeug.http import quote_etag
 from flask_restx import Api, Resource, fields, reqparse, inputs
-# Import Flask application
-from service import app, status  # HTTP Status Codes
-# app.config["APPLICATION_ROOT"] = "/api"
+from service import status  # HTTP Status Codes
+# current_app.config["APPLICATION_ROOT"] = "/api"
 from functools import wraps
+from flask_restx.representations import output_json
+from service import logs, metrics
 import uuid
+import hashlib
+import hmac
+import json
+import base64
+import codecs
+import csv
+import io
+from urllib.parse import urlencode
 
 
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
 def index():
     """ Root URL response """
-    return app.send_static_file("index.html")
-
+    return current_app.send_static_file("index.html")
 
 
 # ######################################################################
 # # Configure Swagger before initializing it
 # ######################################################################
-api = Api(app,
-          version='1.0.0',
+authorizations = {
+    'apikey': {
+        'type': 'apiKey',
+        'in': 'header',
+        'name': 'X-Api-Key'
+    }
+}
+
+api = Api(version='1.0.0',
           title='Product Demo REST API Service',
           description='This is a sample server Product store server.',
           default='products',
           default_label='Product shop operations',
           doc='/apidocs', # default also could use doc='/apidocs/'
-          prefix=''
+          prefix='',
+          authorizations=authorizations
          )
 
 
+@api.representation("application/json")
+def timed_output_json(data, code, headers=None):
+    """ Encodes what a Resource returns as JSON, counted as serialization time """
+    with metrics.serialization_timer():
+        return output_json(data, code, headers)
+
+
 # Define the model so that the docs reflect what can be sent
 create_model = api.model('Product', {
     'name': fields.String(required=True,
@@ -81,13 +105,120 @@ purchase_model = api.model('Purchase', {
 })
 
 
+batch_result_model = api.model('BatchResult', {
+    'index': fields.Integer(description='The position of the item in the request'),
+    'status': fields.Integer(description='The HTTP status for this item'),
+    'id': fields.Integer(description='The id assigned to the created Product'),
+    'message': fields.String(description='Why the item was rejected'),
+})
+
+
+rejected_row_model = api.model('RejectedRow', {
+    'line': fields.Integer(description='The line of the CSV file'),
+    'message': fields.String(description='Why the row was rejected'),
+})
+
+import_result_model = api.model('ImportResult', {
+    'inserted': fields.Integer(description='The number of Products created'),
+    'updated': fields.Integer(description='The number of Products updated in upsert mode'),
+    'duplicates': fields.Integer(description='The rows skipped in upsert mode for a later row with the same name and owner'),
+    'rejected_count': fields.Integer(description='The number of rows that were not valid'),
+    'rejected': fields.List(fields.Nested(rejected_row_model),
+                            description='The first rejected rows and why'),
+})
+
+
+checkout_result_model = api.model('CheckoutResult', {
+    'id': fields.Integer(description='The id of the Product'),
+    'amount': fields.Integer(description='The amount of the Product'),
+    'status': fields.Integer(description='The HTTP status for this line, 424 if only another line failed'),
+    'inventory': fields.Integer(description='The inventory of the Product after the checkout'),
+})
+
+
+facet_value_model = api.model('FacetValue', {
+    'value': fields.String(description='The category or owner'),
+    'count': fields.Integer(description='The number of Products with this value'),
+})
+
+price_stats_model = api.model('PriceStats', {
+    'min': fields.Float(description='The lowest price'),
+    'max': fields.Float(description='The highest price'),
+    'avg': fields.Float(description='The average price'),
+})
+
+price_bucket_model = api.model('PriceBucket', {
+    'low': fields.Float(description='The lowest price in the bucket'),
+    'high': fields.Float(description='The highest price in the bucket'),
+    'count': fields.Integer(description='The number of Products in the bucket'),
+})
+
+facets_model = api.model('Facets', {
+    'count': fields.Integer(description='The number of matching Products'),
+    'price': fields.Nested(price_stats_model),
+    'categories': fields.List(fields.Nested(facet_value_model)),
+    'owners': fields.List(fields.Nested(facet_value_model)),
+    'histogram': fields.List(fields.Nested(price_bucket_model)),
+})
+
+
+# the fields of product_model, serialized without marshalling
+LIST_FIELDS = tuple(product_model.resolved.keys())
+product_serializer = RowSerializer(LIST_FIELDS)
+
+# media types that the catalog can be exported as
+EXPORT_MEDIA_TYPES = ["application/x-ndjson", "text/csv"]
+
 # query string arguments
 product_args = reqparse.RequestParser()
-product_args.add_argument('name', type=str, required=False, help='List Pets by name')
-product_args.add_argument('category', type=str, required=False, help='List Pets by category')
-product_args.add_argument('owner', type=str, required=False, help='List Pets by owner')
-product_args.add_argument('low', type=str, required=False, help='List Pets by min price')
-product_args.add_argument('high', type=str, required=False, help='List Pets by max price')
+product_args.add_argument('name', type=str, action='append', required=False, help='List Products by name (repeat for any of several)')
+product_args.add_argument('category', type=str, action='append', required=False, help='List Products by category (repeat for any of several)')
+product_args.add_argument('owner', type=str, action='append', required=False, help='List Products by owner (repeat for any of several)')
+product_args.add_argument('low', type=float, required=False, help='List Products by min price')
+product_args.add_argument('high', type=float, required=False, help='List Products by max price')
+product_args.add_argument('q', type=str, required=False, help='Full-text search of name and description, best matches first')
+product_args.add_argument('limit', type=int, required=False, help='Maximum number of Products per page')
+product_args.add_argument('cursor', type=str, required=False, help='Opaque cursor from a previous page')
+product_args.add_argument('fields', type=str, required=False, help='Comma separated fields to return (id is always returned)')
+
+export_args = product_args.copy()
+for argument in ('q', 'limit', 'cursor', 'fields'):
+    export_args.remove_argument(argument)
+
+facet_args = product_args.copy()
+for argument in ('limit', 'cursor', 'fields'):
+    facet_args.remove_argument(argument)
+facet_args.add_argument('buckets', type=int, required=False, help='Number of price histogram buckets')
+facet_args.add_argument('facet_limit', type=int, required=False, help='Most category and owner values to count')
+
+import_args = reqparse.RequestParser()
+import_args.add_argument('mode', type=str, location='args', required=False, default='insert', choices=('insert', 'upsert'),
+                         help='insert every row, or update the Products with the same name and owner')
+
+fields_args = reqparse.RequestParser()
+fields_args.add_argument('fields', type=str, required=False, help='Comma separated fields to return (id is always returned)')
+
+
+######################################################################
+# Authorization Decorator
+######################################################################
+def token_required(f):
+    """ Decorator that requires the configured API key in the X-Api-Key header """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = request.headers.get('X-Api-Key')
+        api_key = current_app.config.get('API_KEY')
+        # compare in constant time so the key cannot be guessed from timings
+        if api_key and token and hmac.compare_digest(token.encode('utf-8'), api_key.encode('utf-8')):
+            return f(*args, **kwargs)
+        return {'message': 'Invalid or missing token'}, status.HTTP_401_UNAUTHORIZED
+    return decorated
+
+
+def generate_apikey():
+    """ Helper function used when testing API keys """
+    return uuid.uuid4().hex
+
 
 
 # ######################################################################
@@ -100,33 +231,45 @@ class ProductCollection(Resource):
     ######################################################################
     @api.doc('list_products')
     @api.expect(product_args, validate=True)
-    @api.marshal_list_with(product_model)
+    @api.response(304, 'The list has not changed since the ETag in If-None-Match')
+    @api.response(400, 'The filters, fields, page size or cursor were not valid')
+    @api.response(200, 'Success', [product_model])
     def get(self):
         """ Returns all of the products """
-        app.logger.info("Request for product list")
-        products = []
-        name = request.args.get('name')
-        price_low = request.args.get("low")
-        price_high = request.args.get("high")
-        owner = request.args.get("owner")
-        category = request.args.get("category")
-        if name:
-            app.logger.info("Find by name: %s", name)
-            products = Product.find_by_name(name).all()
-        elif price_low and price_high:
-            app.logger.info("Find by price from %s to %s", price_low, price_high)
-            products = Product.find_by_price(price_low, price_high).all()
-        elif owner:
-            app.logger.info("Find by owner: %s", owner)
-            products = Product.find_by_owner(owner).all()
-        elif category:
-            app.logger.info("Find by category: %s", category)
-            products = Product.find_by_category(category).all()
+        current_app.logger.info("Request for product list")
+        filters = get_product_filters()
+        search = request.args.get("q", "").strip() or None
+        limit = get_page_size(get_int_arg("limit"))
+        current_app.logger.info("Find by filters: %s", filters)
+        query = Product.find_by_filters(**filters)
+        if search:
+            query = Product.search(query, search)
+        # select plain row tuples and encode them straight to JSON, the
+        # version tags the page and is left out by the serializer
+        fields = get_fields()
+        query = Product.select_fields(query, fields + ("version",))
+        # fetch one extra row to learn whether there is a next page
+        if search:
+            current_app.logger.info("Search for: %s", search)
+            offset = decode_cursor(request.args.get("cursor"), "offset") or 0
+            products = query.offset(offset).limit(limit + 1).all()
         else:
-            products = Product.all()
-        app.logger.info('[%s] Products returned', len(products))
-        results = [Product.serialize() for Product in products]
-        return results, status.HTTP_200_OK
+            last_id = decode_cursor(request.args.get("cursor"))
+            products = Product.paginate(query, last_id, limit + 1)
+        etag = collection_etag(products)
+        check_not_modified(etag)
+        headers = {"ETag": quote_etag(etag)}
+        if len(products) > limit:
+            products = products[:limit]
+            if search:
+                headers.update(next_page_headers("offset", offset + limit))
+            else:
+                headers.update(next_page_headers("id", products[-1].id))
+        current_app.logger.info('[%s] Products returned', len(products))
+        serializer = product_serializer if fields == LIST_FIELDS else RowSerializer(fields)
+        with metrics.serialization_timer():
+            body = serializer.dumps(products)
+        return Response(body, status=status.HTTP_200_OK, mimetype="application/json", headers=headers)
 
     ######################################################################
     # CREATE A PRODUCT
@@ -141,18 +284,214 @@ class ProductCollection(Resource):
         Creates a Product
         This endpoint will create a Product based the data in the body that is posted
         """
-        app.logger.info("Request to create a product")
+        current_app.logger.info("Request to create a product")
         check_content_type("application/json")
         product = Product()
-        app.logger.debug('Payload = %s', api.payload)
+        current_app.logger.debug('Payload = %s', api.payload)
         create_model.validate(api.payload) # validate manually
         product.deserialize(api.payload)
         product.create()
-        app.logger.info('Product with new id [%s] created!', product.id)
+        current_app.logger.info('Product with new id [%s] created!', product.id)
         location_url = api.url_for(ProductResource, product_id=product.id, _external=True)
         return product.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
 
 
+######################################################################
+#  PATH: /products/facets
+######################################################################
+@api.route('/products/facets')
+class ProductFacets(Resource):
+    """
+    ProductFacets class
+
+    Summarizes the Products that match the list filters
+    GET /products/facets - Returns counts and price statistics of the matches
+    """
+    ######################################################################
+    # FACETS OF THE PRODUCT LIST
+    ######################################################################
+    @api.doc('facet_products')
+    @api.expect(facet_args, validate=True)
+    @api.response(400, 'The filters, buckets or facet limit were not valid')
+    @api.marshal_with(facets_model)
+    def get(self):
+        """
+        Returns facets of the products
+
+        Category and owner counts, price statistics and a price histogram
+        of the Products that match the same filters as the list
+        """
+        current_app.logger.info("Request for product facets")
+        filters = get_product_filters()
+        search = request.args.get("q", "").strip() or None
+        buckets = get_int_arg("buckets", 10)
+        facet_limit = get_int_arg("facet_limit", 20)
+        if not 1 <= buckets <= current_app.config["MAX_FACET_BUCKETS"]:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  "buckets must be between 1 and {}".format(current_app.config["MAX_FACET_BUCKETS"]))
+        if facet_limit < 1:
+            abort(status.HTTP_400_BAD_REQUEST, "facet_limit must be a positive integer")
+        query = Product.find_by_filters(**filters)
+        if search:
+            query = Product.search(query, search)
+        facets = Product.facets(query, buckets, min(facet_limit, current_app.config["MAX_PAGE_SIZE"]))
+        current_app.logger.info("Facets of [%s] Products returned", facets["count"])
+        return facets, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /products:batch
+######################################################################
+@api.route('/products:batch')
+class ProductBatch(Resource):
+    """
+    ProductBatch class
+
+    Creates many Products in one request and one transaction
+    POST /products:batch - Creates every valid Product in the posted array
+    """
+    ######################################################################
+    # CREATE PRODUCTS IN BULK
+    ######################################################################
+    @api.doc('create_products_batch')
+    @api.expect([create_model])
+    @api.response(201, 'All Products created successfully', [batch_result_model])
+    @api.response(207, 'Some Products were rejected', [batch_result_model])
+    @api.response(400, 'None of the posted Products were valid')
+    @api.response(413, 'Too many Products in one batch')
+    def post(self):
+        """
+        Creates Products in bulk
+        This endpoint validates each Product in the posted array and creates the valid ones together
+        """
+        current_app.logger.info("Request to create a batch of products")
+        check_content_type("application/json")
+        payload = api.payload
+        if not isinstance(payload, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be an array of Products")
+        if len(payload) > current_app.config["MAX_BATCH_SIZE"]:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                "A batch may contain at most {} Products".format(current_app.config["MAX_BATCH_SIZE"]),
+            )
+        results = []
+        products = []
+        for index, item in enumerate(payload):
+            try:
+                create_model.validate(item)
+                # too long or out of range values would fail the whole INSERT
+                products.append(Product().deserialize(Product.validate_columns(Product.validate(item))))
+                results.append({"index": index, "status": status.HTTP_201_CREATED})
+            except (HTTPException, DataValidationError) as error:
+                message = getattr(error, "data", {}).get("errors") or str(error)
+                results.append({"index": index, "status": status.HTTP_400_BAD_REQUEST, "message": str(message)})
+        Product.create_many(products)
+        created = iter(products)
+        for result in results:
+            if result["status"] == status.HTTP_201_CREATED:
+                result["id"] = next(created).id
+        current_app.logger.info("[%s] of [%s] Products created", len(products), len(payload))
+        if len(products) == len(payload):
+            return results, status.HTTP_201_CREATED
+        if not products:
+            return results, status.HTTP_400_BAD_REQUEST
+        return results, status.HTTP_207_MULTI_STATUS
+
+
+######################################################################
+#  PATH: /products:import
+######################################################################
+@api.route('/products:import')
+class ProductImport(Resource):
+    """
+    ProductImport class
+
+    Loads a supplier catalog from a CSV file in one transaction
+    POST /products:import - Creates or updates a Product for every valid row
+    """
+    ######################################################################
+    # IMPORT PRODUCTS FROM CSV
+    ######################################################################
+    @api.doc('import_products', security='apikey')
+    @api.expect(import_args)
+    @api.response(201, 'Every row was imported', import_result_model)
+    @api.response(207, 'Some rows were rejected', import_result_model)
+    @api.response(400, 'None of the rows were valid')
+    @api.response(401, 'Invalid or missing API key')
+    @api.response(415, 'The body is not text/csv')
+    @token_required
+    def post(self):
+        """
+        Imports Products from CSV
+        This endpoint streams a CSV file with a header row of the Product fields into the database
+        """
+        current_app.logger.info("Request to import products")
+        check_content_type("text/csv")
+        args = import_args.parse_args()
+        # gunicorn's input stream only has read(), which is all a StreamReader needs
+        lines = codecs.getreader("utf-8")(request.stream)
+        try:
+            report = Product.import_csv(lines, args["mode"] == "upsert", current_app.config["IMPORT_MAX_REJECTS"])
+        except UnicodeDecodeError:
+            abort(status.HTTP_400_BAD_REQUEST, "CSV must be UTF-8 encoded")
+        if not report["rejected_count"]:
+            return report, status.HTTP_201_CREATED
+        if not report["inserted"] and not report["updated"]:
+            return report, status.HTTP_400_BAD_REQUEST
+        return report, status.HTTP_207_MULTI_STATUS
+
+
+######################################################################
+#  PATH: /products/export
+######################################################################
+@api.route('/products/export')
+class ProductExport(Resource):
+    """
+    ProductExport class
+
+    Streams the whole catalog without loading it into memory
+    GET /products/export - Returns every Product as NDJSON or CSV
+    """
+    ######################################################################
+    # EXPORT ALL PRODUCTS
+    ######################################################################
+    @api.doc('export_products')
+    @api.expect(export_args)
+    @api.produces(EXPORT_MEDIA_TYPES)
+    @api.response(200, 'The catalog as NDJSON or CSV, gzip compressed when accepted')
+    @api.response(406, 'The requested media type is not supported')
+    def get(self):
+        """
+        Export Products
+
+        This endpoint streams every Product that matches the filters as NDJSON or CSV based on the Accept header
+        """
+        current_app.logger.info("Request to export products")
+        # a client that sends no Accept takes anything, so it gets NDJSON
+        media_type = request.accept_mimetypes.best_match(
+            EXPORT_MEDIA_TYPES, default=None if request.accept_mimetypes else EXPORT_MEDIA_TYPES[0]
+        )
+        if not media_type:
+            abort(
+                status.HTTP_406_NOT_ACCEPTABLE,
+                "Accept must be one of {}".format(", ".join(EXPORT_MEDIA_TYPES)),
+            )
+        query = Product.find_by_filters(**get_product_filters())
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if media_type == "text/csv":
+            headers["Content-Disposition"] = "attachment; filename=products.csv"
+            if _is_postgresql():
+                body = Product.stream_csv(query)
+            else:
+                body = generate_csv(Product.stream_all(current_app.config["EXPORT_BATCH_SIZE"], query))
+        else:
+            body = generate_ndjson(Product.stream_all(current_app.config["EXPORT_BATCH_SIZE"], query))
+        if request.accept_encodings["gzip"]:
+            body = gzip_chunks(body)
+            headers["Content-Encoding"] = "gzip"
+        return Response(stream_with_context(body), mimetype=media_type, headers=headers)
+
+
 ######################################################################
 #  PATH: /products/{id}
 ######################################################################
@@ -171,21 +510,29 @@ class ProductResource(Resource):
     # RETRIEVE A PRODUCT
     ######################################################################
     @api.doc('get_products')
+    @api.expect(fields_args)
+    @api.response(200, 'Success', product_model)
+    @api.response(304, 'The Product has not changed since the ETag in If-None-Match')
+    @api.response(400, 'The fields were not valid')
     @api.response(404, 'Product not found')
-    @api.marshal_with(product_model)
     def get(self, product_id):
         """
         Retrieve a single Product
 
         This endpoint will return a Product based on it's id
         """
-        app.logger.info("Request for product with id: %s", product_id)
-        product = Product.find(product_id)
+        current_app.logger.info("Request for product with id: %s", product_id)
+        fields = get_fields()
+        product = Product.find_serialized(product_id)
         if not product:
             api.abort(status.HTTP_404_NOT_FOUND, "Product with id '{}' was not found.".format(product_id))
         # product = Product.find_or_404(product_id)
-
-        return product.serialize(), status.HTTP_200_OK
+        etag = product_etag(product, fields)
+        check_not_modified(etag)
+        with metrics.serialization_timer():
+            body = dumps({field: product[field] for field in fields})
+        return Response(body, status=status.HTTP_200_OK, mimetype="application/json",
+                        headers={"ETag": quote_etag(etag)})
 
     ######################################################################
     # UPDATE AN EXISTING PRODUCT
@@ -193,6 +540,8 @@ class ProductResource(Resource):
     @api.doc('update_products')
     @api.response(404, 'Product not found')
     @api.response(400, 'The posted Product data was not valid')
+    @api.response(409, 'The Product was changed by another request')
+    @api.response(412, 'The Product no longer matches the ETag in If-Match')
     @api.expect(product_model, validate=True)
     @api.marshal_with(product_model)
     def put(self, product_id):
@@ -200,19 +549,38 @@ class ProductResource(Resource):
         Update a Product
         This endpoint will update a Product based the body that is posted
         """
-        app.logger.info("Request to update Product with id %s", product_id)
+        current_app.logger.info("Request to update Product with id %s", product_id)
         check_content_type("application/json")
+        current_app.logger.debug('Payload = %s', api.payload)
+        version = get_if_match_version(product_id)
+        if version is not None:
+            # a single UPDATE ... WHERE id = :id AND version = :version
+            data = Product.update_if_version(product_id, api.payload, version)
+            if not data:
+                if not Product.find(product_id):
+                    abort(status.HTTP_404_NOT_FOUND, "Product with id '{}' was not found.".format(product_id))
+                abort(
+                    status.HTTP_412_PRECONDITION_FAILED,
+                    "Product with id '{}' has changed since version {}.".format(product_id, version),
+                )
+            current_app.logger.info("Product with id [%d] updated.", product_id)
+            return data, status.HTTP_200_OK, {"ETag": quote_etag(product_etag(data))}
+
         product = Product.find(product_id)
         if not product:
             abort(status.HTTP_404_NOT_FOUND, "Product with id '{}' was not found.".format(product_id))
 
-        app.logger.debug('Payload = %s', api.payload)
         data = api.payload
         product.deserialize(data)
         product.id = product_id
-        product.update()
-        app.logger.info("Product with id [%d] updated.", product.id)
-        return product.serialize(), status.HTTP_200_OK
+        try:
+            product.update()
+        except StaleDataError:
+            db.session.rollback()
+            abort(status.HTTP_409_CONFLICT, "Product with id '{}' was changed by another request.".format(product_id))
+        current_app.logger.info("Product with id [%d] updated.", product.id)
+        data = product.serialize()
+        return data, status.HTTP_200_OK, {"ETag": quote_etag(product_etag(data))}
 
     ######################################################################
     # DELETE A PRODUCT
@@ -225,17 +593,17 @@ class ProductResource(Resource):
         Delete a Product
         This endpoint will delete a Product based the id specified in the path
         """
-        app.logger.info("Request to delete Product with id %s", product_id)
+        current_app.logger.info("Request to delete Product with id %s", product_id)
         product = Product.find(product_id)
         if product:
             product.delete()
-        app.logger.info("Product with id [%s] delete", product_id)
+        current_app.logger.info("Product with id [%s] delete", product_id)
         return '', status.HTTP_204_NO_CONTENT
 
 ######################################################################
 #  PATH: /products/{id}/purchase
 ######################################################################
-@api.route('/products/<product_id>/purchase')
+@api.route('/products/<int:product_id>/purchase')
 @api.param('product_id', 'The Product identifier')
 # @api.expect(purchase_model)
 class PurchaseResource(Resource):
@@ -243,6 +611,7 @@ class PurchaseResource(Resource):
     # PURCHASE A product
     # #####################################################################
     @api.doc('purchase_products')
+    @api.response(400, 'The purchase amount was not valid')
     @api.response(404, 'Product not found')
     @api.response(409, 'The Product cannot be purchased now')
     @api.expect(purchase_model, validate=True)
@@ -251,21 +620,93 @@ class PurchaseResource(Resource):
         """Purchase a product"""
         data = api.payload
         amount = data['amount']
-        app.logger.info("Request to purchase %d product with id %s", amount, product_id)
+        current_app.logger.info("Request to purchase %d product with id %s", amount, product_id)
         check_content_type("application/json")
-        product = Product.find(product_id)
+        if amount < 1:
+            abort(status.HTTP_400_BAD_REQUEST, "amount must be a positive integer")
+        product = Product.purchase(product_id, amount)
         if not product:
+            if not Product.find(product_id):
+                abort(
+                    status.HTTP_404_NOT_FOUND, "product with id '{}' was not found.".format(product_id)
+                )
             abort(
-                status.HTTP_404_NOT_FOUND, "product with id '{}' was not found.".format(product_id)
+                status.HTTP_409_CONFLICT,
+                "Product with id [{}] does not have {} in inventory.".format(product_id, amount),
             )
-        product.inventory -= amount
-        product.update()
         # TODO: Call Shopcarts & Inventory Service APIs to execute the purchase
         # result = other_service.purchase(product)
         # if not result.success:
         #     abort(status.HTTP_409_CONFLICT, 'Product with id [{}] cannot be purchased now.'.format(product_id))
-        app.logger.info('Peroduct with id [%s] has been purchased!', product.id)
-        return product.serialize(), status.HTTP_200_OK
+        current_app.logger.info('Peroduct with id [%s] has been purchased!', product_id)
+        return product, status.HTTP_200_OK
+
+######################################################################
+#  PATH: /products/checkout
+######################################################################
+@api.route('/products/checkout')
+class CheckoutResource(Resource):
+    """
+    CheckoutResource class
+
+    Purchases every line of a cart together
+    POST /products/checkout - Purchases all of the posted lines or none of them
+    """
+    # #####################################################################
+    # CHECKOUT A CART
+    # #####################################################################
+    @api.doc('checkout_products')
+    @api.response(200, 'Every line was purchased', [checkout_result_model])
+    @api.response(400, 'The posted lines were not valid')
+    @api.response(409, 'Some lines cannot be purchased now', [checkout_result_model])
+    @api.expect([purchase_model], validate=True)
+    def post(self):
+        """
+        Checkout a cart
+        This endpoint purchases every posted line in one transaction or none of them
+        """
+        current_app.logger.info("Request to checkout a cart")
+        check_content_type("application/json")
+        lines = api.payload
+        if not isinstance(lines, list) or not lines:
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be a non-empty array of purchases")
+        if any(line['amount'] < 1 for line in lines):
+            abort(status.HTTP_400_BAD_REQUEST, "amount must be a positive integer")
+        results = Product.checkout([(line['id'], line['amount']) for line in lines])
+        if any(result['status'] != status.HTTP_200_OK for result in results):
+            current_app.logger.info("Cart with [%s] lines cannot be purchased now", len(lines))
+            return results, status.HTTP_409_CONFLICT
+        current_app.logger.info("Cart with [%s] lines has been purchased!", len(lines))
+        return results, status.HTTP_200_OK
+
+######################################################################
+#  PATH: /swagger.json
+######################################################################
+def swagger_spec():
+    """ Serves the Swagger spec from memory
+
+    flask_restx encodes the spec as JSON again on every request, here it is
+    encoded and gzipped once per worker and polling it with If-None-Match
+    gets a 304
+    """
+    spec = current_app.extensions.get("swagger_spec")
+    if spec is None:
+        schema = api.__schema__
+        if "error" in schema:
+            abort(status.HTTP_500_INTERNAL_SERVER_ERROR, schema["error"])
+        spec = current_app.extensions["swagger_spec"] = EncodedBody(schema)
+    compress = bool(request.accept_encodings["gzip"])
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if request.if_none_match.contains_weak(spec.etag) or request.if_none_match.contains_weak(spec.etag + "-gzip"):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    else:
+        response = Response(spec.gzipped if compress else spec.body, mimetype="application/json", headers=headers)
+        if compress:
+            response.headers["Content-Encoding"] = "gzip"
+    # the gzipped bytes are a different representation, so another etag
+    response.set_etag(spec.etag + "-gzip" if compress else spec.etag)
+    return response
+
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
@@ -273,37 +714,165 @@ class PurchaseResource(Resource):
 # @app.before_first_request
 def initialize_logging(log_level=logging.INFO):
     """Initialized the default logging to STDOUT"""
-    if not app.debug:
+    if not current_app.debug:
         print("Setting up logging...")
-        # Set up default logging for submodules to use STDOUT
-        # datefmt='%m/%d/%Y %I:%M:%S %p'
-        fmt = "[%(asctime)s] %(levelname)s in %(module)s: %(message)s"
-        logging.basicConfig(stream=sys.stdout, level=log_level, format=fmt)
-        # Make a new log handler that uses STDOUT
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(logging.Formatter(fmt))
-        handler.setLevel(log_level)
-        # Remove the Flask default handlers and use our own
-        handler_list = list(app.logger.handlers)
-        for log_handler in handler_list:
-            app.logger.removeHandler(log_handler)
-        app.logger.addHandler(handler)
-        app.logger.setLevel(log_level)
-        app.logger.propagate = False
-        app.logger.info("Logging handler established")
-
-def init_db():
+        # the records are written to STDOUT by the thread of the logging queue
+        logs.init_app(current_app, log_level)
+
+def init_app(app):
+    """ Registers the index page and the REST API on the app """
+    app.add_url_rule("/", "index", index)
+    api.init_app(app)
+    # serve the spec flask_restx registered from memory instead
+    app.view_functions["specs"] = swagger_spec
+
+def init_db(app):
     """ Initializes the SQLAlchemy app """
-    global app
     Product.init_db(app)
 
 def check_content_type(media_type):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
-    if content_type and content_type == media_type:
+    # the mimetype leaves out parameters such as charset
+    if content_type and request.mimetype == media_type:
         return
-    app.logger.error("Invalid Content-Type: %s", content_type)
+    current_app.logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         "Content-Type must be {}".format(media_type),
     )
+
+class NotModified(Exception):
+    """ Used when a conditional GET finds the client's copy is still current """
+
+    def __init__(self, etag):
+        super().__init__("Not Modified")
+        self.etag = etag
+
+def product_etag(product, fields=None):
+    """Returns the entity tag of a serialized Product, or of just some fields of it"""
+    etag = "{}-{}".format(product["id"], product["version"])
+    if fields and fields != LIST_FIELDS:
+        etag += ";" + ",".join(fields)
+    return etag
+
+def collection_etag(rows):
+    """Returns the entity tag of a page of Product rows, with the row after it"""
+    digest = hashlib.sha1(request.full_path.encode("utf-8"))
+    digest.update(Product.fingerprint(rows).encode("ascii"))
+    return digest.hexdigest()
+
+def get_if_match_version(product_id):
+    """Returns the version of the Product named by If-Match, or None without one"""
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    for etag in if_match.as_set(include_weak=False):
+        # a tag of some fields names the same version as the full one
+        tag_id, _, version = etag.partition(";")[0].partition("-")
+        if tag_id == str(product_id) and version.isdigit():
+            return int(version)
+    current_app.logger.error("Invalid If-Match: %s", request.headers.get("If-Match"))
+    abort(
+        status.HTTP_412_PRECONDITION_FAILED,
+        "If-Match does not name a version of Product with id '{}'.".format(product_id),
+    )
+
+def check_not_modified(etag):
+    """Stops the request with a 304 if If-None-Match has the current etag"""
+    if request.if_none_match.contains_weak(etag):
+        raise NotModified(etag)
+
+def get_fields():
+    """Returns the Product fields asked for in the query string, in model order"""
+    requested = request.args.get("fields")
+    if not requested:
+        return LIST_FIELDS
+    names = {name.strip() for name in requested.split(",") if name.strip()}
+    unknown = names.difference(LIST_FIELDS)
+    if unknown:
+        abort(status.HTTP_400_BAD_REQUEST, "Unknown fields: {}".format(", ".join(sorted(unknown))))
+    names.add("id")
+    return tuple(field for field in LIST_FIELDS if field in names)
+
+def get_product_filters():
+    """Returns the Product filters given in the query string"""
+    filters = {
+        "names": request.args.getlist("name"),
+        "owners": request.args.getlist("owner"),
+        "categories": request.args.getlist("category"),
+    }
+    for bound in ("low", "high"):
+        value = request.args.get(bound)
+        try:
+            filters[bound] = float(value) if value else None
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, "{} must be a number".format(bound))
+    return filters
+
+def get_int_arg(name, default=None):
+    """Returns an integer from the query string, the default when it is missing"""
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "{} must be an integer".format(name))
+
+def get_page_size(limit):
+    """Returns the requested page size capped at the server maximum"""
+    max_page_size = current_app.config["MAX_PAGE_SIZE"]
+    if limit is None:
+        return min(current_app.config["DEFAULT_PAGE_SIZE"], max_page_size)
+    if limit < 1:
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be a positive integer")
+    return min(limit, max_page_size)
+
+def encode_cursor(key, value):
+    """Encodes the position of the last Product on a page as an opaque cursor"""
+    payload = json.dumps({key: value}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor, key="id"):
+    """Decodes an opaque cursor back into the position of the last Product seen"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))[key]
+    except (ValueError, TypeError, KeyError, UnicodeError):
+        value = None
+    if not isinstance(value, int) or isinstance(value, bool):
+        current_app.logger.error("Invalid cursor: %s", cursor)
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid cursor: {}".format(cursor))
+    return value
+
+def next_page_headers(key, value):
+    """Builds the Link and X-Next-Cursor headers that point to the next page"""
+    cursor = encode_cursor(key, value)
+    args = request.args.to_dict(flat=False)
+    args["cursor"] = [cursor]
+    link = "{}?{}".format(request.base_url, urlencode(args, doseq=True))
+    return {"Link": '<{}>; rel="next"'.format(link), "X-Next-Cursor": cursor}
+
+def generate_ndjson(rows):
+    """Yields one JSON document per Product row"""
+    for row in rows:
+        yield json.dumps(dict(zip(PRODUCT_FIELDS, row))) + "\n"
+
+def generate_csv(rows, chunk_size=500):
+    """Yields the Product rows as CSV in chunks of chunk_size rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(PRODUCT_FIELDS)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,76 @@
+"""
+Serializers for Product
+Fast paths that turn Product rows straight into JSON response bodies
+without building ORM objects or walking flask_restx fields
+"""
+import hashlib
+import json
+import zlib
+
+try:
+    import orjson  # optional, used when installed
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# one encoder for every request instead of a new one per json.dumps call
+_encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(",", ":"))
+
+
+def dumps(data):
+    """Encodes data as UTF-8 JSON bytes with the fastest encoder available"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return _encoder.encode(data).encode("utf-8")
+
+
+class RowSerializer():
+    """
+    Serializes row tuples whose columns are in the order of fields
+
+    The field names are bound once so each row costs a single zip
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+
+    def to_dicts(self, rows):
+        """ Returns the rows as a list of dictionaries """
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in rows]
+
+    def dumps(self, rows):
+        """ Returns the rows as a JSON array in bytes """
+        return dumps(self.to_dicts(rows))
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses an iterator of text or bytes chunks into gzip chunks
+
+    Each chunk is compressed as it arrives, so a streamed response stays
+    streamed and only the compressor's window is held in memory
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class EncodedBody():
+    """
+    A JSON document encoded once and kept with a gzipped copy and an etag
+
+    For responses that are the same on every request, serving one then
+    costs no encoding and no compression
+    """
+
+    def __init__(self, data, level=9):
+        # sorted keys, so every worker has the same bytes and the same etag
+        self.body = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        # zlib writes no timestamp, so the gzipped bytes are the same too
+        self.gzipped = b"".join(gzip_chunks([self.body], level))
+        self.etag = hashlib.sha1(self.body).hexdigest()
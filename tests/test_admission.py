@@ -0,0 +1,129 @@
+"""
+Test cases for the Service Admission Control
+"""
+import importlib
+import os
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+import config
+from service import app
+from service.admission import Admission, ConcurrencyLimiter, TokenBuckets, request_class
+
+
+######################################################################
+#  C O N C U R R E N C Y   L I M I T E R   T E S T   C A S E S
+######################################################################
+class TestConcurrencyLimiter(unittest.TestCase):
+    """ Test Cases for ConcurrencyLimiter """
+
+    def test_limit(self):
+        """ Let limit requests in and time the next one out """
+        limiter = ConcurrencyLimiter("test", 2, 0.01)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertEqual(REGISTRY.get_sample_value("admission_in_flight", {"request_class": "test"}), 2)
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+        limiter.release()
+        limiter.release()
+        self.assertEqual(REGISTRY.get_sample_value("admission_in_flight", {"request_class": "test"}), 0)
+
+    def test_queue(self):
+        """ Wait for a slot that frees up within the queue timeout """
+        limiter = ConcurrencyLimiter("test", 1, 5)
+        limiter.acquire()
+        timer = threading.Timer(0.05, limiter.release)
+        timer.start()
+        self.assertTrue(limiter.acquire())
+        timer.join()
+        limiter.release()
+
+
+######################################################################
+#  T O K E N   B U C K E T   T E S T   C A S E S
+######################################################################
+class TestTokenBuckets(unittest.TestCase):
+    """ Test Cases for TokenBuckets """
+
+    def test_burst(self):
+        """ Allow a burst, then ask the client to wait for the next token """
+        buckets = TokenBuckets(rate=10, burst=3)
+        self.assertEqual([buckets.take("a") for _ in range(3)], [0, 0, 0])
+        wait = buckets.take("a")
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+        # another client has a bucket of its own
+        self.assertEqual(buckets.take("b"), 0)
+
+    def test_refill(self):
+        """ Refill the bucket at the rate """
+        buckets = TokenBuckets(rate=100, burst=1)
+        self.assertEqual(buckets.take("a"), 0)
+        self.assertGreater(buckets.take("a"), 0)
+        time.sleep(0.05)
+        self.assertEqual(buckets.take("a"), 0)
+
+    def test_forget_clients(self):
+        """ Forget the least recently seen clients """
+        buckets = TokenBuckets(rate=1, burst=1, max_clients=2)
+        for client in ("a", "b", "c"):
+            buckets.take(client)
+        # a was forgotten, so it has a full bucket again
+        self.assertEqual(buckets.take("a"), 0)
+        self.assertGreater(buckets.take("c"), 0)
+
+
+######################################################################
+#  R E Q U E S T   C L A S S   T E S T   C A S E S
+######################################################################
+class TestRequestClass(unittest.TestCase):
+    """ Test Cases for the classes of requests """
+
+    def request_class_of(self, path, method="GET"):
+        """ Returns the class of a request to a path """
+        with app.test_request_context(path, method=method):
+            return request_class()
+
+    def test_classes(self):
+        """ Tell reads, writes and purchases apart """
+        self.assertEqual(self.request_class_of("/products"), "reads")
+        self.assertEqual(self.request_class_of("/products/1"), "reads")
+        self.assertEqual(self.request_class_of("/products", "POST"), "writes")
+        self.assertEqual(self.request_class_of("/products/1", "DELETE"), "writes")
+        self.assertEqual(self.request_class_of("/products/1/purchase", "POST"), "purchases")
+        self.assertEqual(self.request_class_of("/products/checkout", "POST"), "purchases")
+
+    def test_not_limited(self):
+        """ Never limit the metrics, the docs or the index """
+        for path in ("/metrics", "/swagger.json", "/apidocs", "/"):
+            self.assertIsNone(self.request_class_of(path))
+
+    def test_config(self):
+        """ Build the limiters from the config, 0 turns one off """
+        config = dict(app.config, READ_CONCURRENCY=0, RATE_LIMIT=5)
+        with patch.dict(app.config, config):
+            admission = Admission(app.config)
+        self.assertEqual(sorted(admission.limiters), ["purchases", "writes"])
+        self.assertEqual(admission.buckets.rate, 5)
+
+    def test_default_limits(self):
+        """ Admit a purchase while reads and writes are saturated """
+        with patch.dict(os.environ, {"WORKER_CONCURRENCY": "4", "DB_POOL_SIZE": "4", "DB_MAX_OVERFLOW": "10"}):
+            defaults = dict(vars(importlib.reload(config)))
+        importlib.reload(config)
+        admission = Admission(defaults)
+        reads, writes, purchases = (admission.limiters[name] for name in ("reads", "writes", "purchases"))
+        # a 4 thread worker sheds reads, whatever the pool overflow
+        self.assertEqual((reads.limit, writes.limit, purchases.limit), (2, 1, 4))
+        for limiter in (reads, writes):
+            limiter.queue_timeout = 0.01
+            for _ in range(limiter.limit):
+                self.assertTrue(limiter.acquire())
+            self.assertFalse(limiter.acquire())
+        self.assertTrue(purchases.acquire())
+        for limiter in (reads, reads, writes, purchases):
+            limiter.release()
@@ -0,0 +1,63 @@
+"""
+Test cases for the Product Cache
+"""
+import unittest
+from unittest.mock import patch
+from service.cache import LRUCache
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """ Test Cases for LRUCache """
+
+    def test_get_and_set(self):
+        """ Cache a value and count hits and misses """
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, {"id": 1})
+        self.assertEqual(cache.get(1), {"id": 1})
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """ Evict the least recently used value when full """
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.get(1)
+        cache.set(3, "three")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), "one")
+        self.assertEqual(cache.get(3), "three")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expires(self):
+        """ Expire values after the time to live """
+        cache = LRUCache(maxsize=2, ttl=10)
+        with patch("service.cache.time.monotonic", return_value=100.0):
+            cache.set(1, "one")
+        with patch("service.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_invalidate(self):
+        """ Invalidate values and reject loads that raced a write """
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, "one")
+        stamp = cache.stamp()
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, "stale", stamp)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, "fresh", cache.stamp())
+        self.assertEqual(cache.get(1), "fresh")
+
+    def test_disabled(self):
+        """ A cache with no room never stores anything """
+        cache = LRUCache(maxsize=0, ttl=60)
+        cache.set(1, "one")
+        self.assertIsNone(cache.get(1))
@@ -0,0 +1,128 @@
+"""
+Test cases for the Service Commands
+"""
+import os
+import gzip
+import logging
+import subprocess
+import sys
+import tempfile
+import unittest
+from sqlalchemy import text
+from service import app
+from service.models import db, Product, product_cache
+from service.commands import (
+    CREATE_ALL_BASELINE, CREATE_ALL_REVISIONS, create_all_revision, create_tables, export_products, import_products
+)
+from .test_models import DATABASE_URI
+
+
+######################################################################
+#  I M P O R T   C O M M A N D   T E S T   C A S E S
+######################################################################
+class TestImportProducts(unittest.TestCase):
+    """ Test Cases for the import-products command """
+
+    @classmethod
+    def setUpClass(cls):
+        """ This runs once before the entire test suite """
+        app.config["TESTING"] = True
+        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.logger.setLevel(logging.CRITICAL)
+        Product.init_db(app)
+
+    def setUp(self):
+        """ This runs before each test """
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.drop_all()  # clean up the last tests
+        db.create_all()  # make our sqlalchemy tables
+        product_cache.clear()
+        self.runner = app.test_cli_runner()
+
+    def tearDown(self):
+        """ This runs after each test """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _write_csv(self, text):
+        """ Writes a CSV file that is removed after the test """
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(handle, "w") as csv_file:
+            csv_file.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_create_tables(self):
+        """ Create the tables from the command line """
+        db.session.remove()
+        db.drop_all()
+        result = self.runner.invoke(create_tables)
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(Product.all(), [])
+
+    def test_create_all_revision(self):
+        """ Tell which revision the tables db.create_all() made are at """
+        with db.engine.connect() as connection:
+            self.assertEqual(create_all_revision(connection), CREATE_ALL_REVISIONS[0][0])
+            connection.execute(text("ALTER TABLE product DROP COLUMN version"))
+            connection.execute(text("DROP INDEX ix_product_name"))
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("ALTER TABLE product DROP COLUMN search_vector"))
+            self.assertEqual(create_all_revision(connection), CREATE_ALL_BASELINE)
+            connection.execute(text("CREATE TABLE alembic_version (version_num varchar(32))"))
+            self.addCleanup(db.engine.execute, text("DROP TABLE alembic_version"))
+            self.assertIsNone(create_all_revision(connection))
+
+    def test_upgrade_db(self):
+        """ Stamp the tables db.create_all() made, then run the migrations """
+        if db.engine.dialect.name != "postgresql":
+            self.skipTest("The migrations need PostgreSQL")
+        self.addCleanup(db.engine.execute, text("DROP TABLE IF EXISTS alembic_version"))
+        env = dict(os.environ, DATABASE_URI=DATABASE_URI, FLASK_APP="service:create_app()", LOG_LEVEL="critical")
+        # the second run finds the database up to date
+        for _ in range(2):
+            result = subprocess.run([sys.executable, "-m", "flask", "upgrade-db"], env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.assertEqual(result.returncode, 0, result.stderr)
+        version = db.session.execute(text("SELECT version_num FROM alembic_version")).scalar()
+        self.assertEqual(version, CREATE_ALL_REVISIONS[0][0])
+
+    def test_import_products(self):
+        """ Import Products from a CSV file """
+        path = self._write_csv(
+            "name,description,price,inventory,owner,category\n"
+            "apple,red,1.5,10,bob,fruit\n"
+        )
+        result = self.runner.invoke(import_products, [path])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Imported 1 new and 0 updated Products", result.output)
+        result = self.runner.invoke(import_products, [path, "--upsert"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(Product.all()), 1)
+        self.assertEqual(Product.find(1).version, 2)
+
+    def test_import_products_rejects(self):
+        """ Fail the command when rows are rejected """
+        path = self._write_csv(
+            "name,description,price,inventory,owner,category\n"
+            "apple,red,cheap,10,bob,fruit\n"
+        )
+        result = self.runner.invoke(import_products, [path])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("line 2:", result.output)
+
+    def test_export_products(self):
+        """ Export the filtered Products to a gzip compressed CSV file """
+        path = self._write_csv(
+            "name,description,price,inventory,owner,category\n"
+            "apple,red,1.5,10,bob,fruit\n"
+            "leek,green,2.5,3,ann,vegetable\n"
+        )
+        self.runner.invoke(import_products, [path])
+        result = self.runner.invoke(export_products, [path, "--gzip", "--category", "vegetable"])
+        self.assertEqual(result.exit_code, 0)
+        with gzip.open(path, "rt") as csv_file:
+            lines = csv_file.read().splitlines()
+        self.assertEqual(lines, ["id,name,description,price,inventory,owner,category", "2,leek,green,2.5,3,ann,vegetable"])
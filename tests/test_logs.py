@@ -0,0 +1,177 @@
+"""
+Test cases for the Service Logging
+"""
+import io
+import json
+import logging
+import queue
+import unittest
+from flask import Flask
+from prometheus_client import REGISTRY
+from service import app, logs
+from service.logs import DroppingQueueHandler, JsonFormatter, QueueLogging, RequestFilter
+
+
+def make_record(level=logging.INFO, msg="Processing lookup for id %s ...", args=(7,), exc_info=None):
+    """ Returns a log record of the service logger """
+    return logging.LogRecord("service", level, __file__, 1, msg, args, exc_info)
+
+
+######################################################################
+#  F O R M A T T E R   A N D   F I L T E R   T E S T   C A S E S
+######################################################################
+class TestJsonFormatter(unittest.TestCase):
+    """ Test Cases for JsonFormatter """
+
+    def test_format(self):
+        """ Format a record as one line of JSON """
+        record = make_record()
+        record.method, record.path = "GET", "/products/7"
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Processing lookup for id 7 ...")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], "service")
+        self.assertEqual(entry["method"], "GET")
+        self.assertEqual(entry["path"], "/products/7")
+        self.assertNotIn("exc_info", entry)
+
+    def test_format_exception(self):
+        """ Keep the traceback of a record in one field """
+        try:
+            raise ValueError("bad price")
+        except ValueError as error:
+            record = make_record(logging.ERROR, "Cannot import", (), (type(error), error, error.__traceback__))
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertIn("ValueError: bad price", entry["exc_info"])
+
+
+class TestRequestFilter(unittest.TestCase):
+    """ Test Cases for RequestFilter """
+
+    def test_outside_request(self):
+        """ Keep the records that are not logged by a request """
+        self.assertTrue(RequestFilter(0.0).filter(make_record()))
+
+    def test_request_fields(self):
+        """ Add the method and path of the request """
+        record = make_record()
+        with app.test_request_context("/products/7", method="PUT"):
+            self.assertTrue(RequestFilter().filter(record))
+        self.assertEqual((record.method, record.path), ("PUT", "/products/7"))
+
+    def test_sampling(self):
+        """ Drop the info logs of requests that are not sampled """
+        request_filter = RequestFilter(0.0)
+        with app.test_request_context("/products"):
+            self.assertFalse(request_filter.filter(make_record()))
+            self.assertTrue(request_filter.filter(make_record(logging.WARNING)))
+
+    def test_sampling_whole_request(self):
+        """ Keep or drop all of the info logs of a request together """
+        request_filter = RequestFilter(0.5)
+        for _ in range(20):
+            with app.test_request_context("/products"):
+                kept = {request_filter.filter(make_record()) for _ in range(5)}
+            self.assertEqual(len(kept), 1)
+
+
+######################################################################
+#  Q U E U E   T E S T   C A S E S
+######################################################################
+class TestQueueLogging(unittest.TestCase):
+    """ Test Cases for the logging queue """
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        handler = logging.StreamHandler(self.stream)
+        handler.setFormatter(JsonFormatter())
+        self.queue_logging = QueueLogging(handler, maxsize=10)
+        self.logger = logging.getLogger("test_logs")
+        self.logger.handlers = [self.queue_logging.queue_handler]
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.queue_logging.stop()
+        self.logger.handlers = []
+
+    def lines(self):
+        """ Returns the records written to the stream """
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_write_from_thread(self):
+        """ Write the queued records from the listener thread """
+        self.queue_logging.start()
+        self.logger.info("Product with id [%s] created", 3)
+        self.queue_logging.stop()
+        self.assertEqual([line["message"] for line in self.lines()], ["Product with id [3] created"])
+
+    def test_drop_when_full(self):
+        """ Drop and count the records a full queue has no room for """
+        dropped = REGISTRY.get_sample_value("log_records_dropped_total") or 0.0
+        for number in range(15):
+            self.logger.info("record %s", number)
+        self.assertEqual(self.queue_logging.queue_handler.dropped, 5)
+        self.assertEqual(REGISTRY.get_sample_value("log_records_dropped_total"), dropped + 5)
+        # the records that fit are still written when the queue drains
+        self.queue_logging.start()
+        self.queue_logging.stop()
+        self.assertEqual(len(self.lines()), 10)
+
+    def test_stop_when_full(self):
+        """ Stop waits for room in a full queue rather than failing """
+        self.queue_logging.start()
+        self.queue_logging.listener.stop()
+        for number in range(10):
+            self.logger.info("record %s", number)
+        self.queue_logging.start()
+        self.queue_logging.stop()
+        self.assertEqual(len(self.lines()), 10)
+
+    def test_restart_in_child(self):
+        """ Start a new queue and thread in a forked worker """
+        self.queue_logging.start()
+        old_queue = self.queue_logging.queue_handler.queue
+        self.queue_logging.restart_in_child()
+        self.assertIsNot(self.queue_logging.queue_handler.queue, old_queue)
+        self.logger.info("after fork")
+        self.queue_logging.stop()
+        self.assertEqual(self.lines()[-1]["message"], "after fork")
+        old_queue.put_nowait(None)  # stop the thread of the "parent"
+
+    def test_prepare(self):
+        """ Merge the arguments into the message before the record is queued """
+        handler = DroppingQueueHandler(queue.Queue())
+        record = handler.prepare(make_record(args=({"id": 7},)))
+        self.assertEqual(record.msg, "Processing lookup for id {'id': 7} ...")
+        self.assertIsNone(record.args)
+
+
+######################################################################
+#  A P P   T E S T   C A S E S
+######################################################################
+class TestInitApp(unittest.TestCase):
+    """ Test Cases for logs.init_app """
+
+    def setUp(self):
+        self.app = Flask("service")
+        self.app.config.from_object("config")
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        logs.init_app(app, logging.CRITICAL)
+
+    def test_json_logs(self):
+        """ Send the logs of the app and the models through the queue """
+        queue_logging = logs.init_app(self.app, logging.INFO, self.stream)
+        self.assertEqual(self.app.logger.handlers, [queue_logging.queue_handler])
+        logging.getLogger(logs.MODELS_LOGGER).info("Creating a product")
+        queue_logging.stop()
+        messages = [json.loads(line)["message"] for line in self.stream.getvalue().splitlines()]
+        self.assertEqual(messages, ["Logging handler established", "Creating a product"])
+
+    def test_text_logs(self):
+        """ Write plain text logs when LOG_FORMAT is text """
+        self.app.config["LOG_FORMAT"] = "text"
+        logs.init_app(self.app, logging.INFO, self.stream).stop()
+        self.assertIn("[INFO] [logs] Logging handler established", self.stream.getvalue())
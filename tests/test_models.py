@@ -4,12 +4,17 @@ Test cases for Product Model
 import logging
 import unittest
 import os
+import io
 import json
+from concurrent.futures import ThreadPoolExecutor
 from service import app
-from service.models import Product, DataValidationError, db
+from service.models import Product, DataValidationError, db, include_object, product_cache, PRODUCT_FIELDS
 from .factories import ProductFactory
 from unittest.mock import patch
-from sqlalchemy.exc import InvalidRequestError
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from werkzeug.exceptions import NotFound
 
 DATABASE_URI = os.getenv(
@@ -42,13 +47,17 @@ class TestProduct(unittest.TestCase):
 
     def setUp(self):
         """ This runs before each test """
+        self.app_context = app.app_context()
+        self.app_context.push()
         db.drop_all()  # clean up the last tests
         db.create_all()  # make our sqlalchemy tables
+        product_cache.clear()
 
     def tearDown(self):
         """ This runs after each test """
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
 
     ######################################################################
     #  T E S T   C A S E S
@@ -164,6 +173,268 @@ class TestProduct(unittest.TestCase):
         self.assertEqual(products[0].owner, "test person2")
         self.assertEqual(products[0].category, "B")
 
+    def test_find_by_filters(self):
+        """ Find products by several filters at once """
+        Product(name = "test1", description = "test des1", price = 105, inventory = 100, owner = "test person1", category = "A").create()
+        Product(name = "test2", description = "test des2", price = 85, inventory = 300, owner = "test person2", category = "A").create()
+        Product(name = "test3", description = "test des3", price = 65, inventory = 300, owner = "test person2", category = "B").create()
+        products = Product.find_by_filters(owners=["test person2"], categories=["A"]).all()
+        self.assertEqual([product.name for product in products], ["test2"])
+        products = Product.find_by_filters(names=["test1", "test3"], low=70).all()
+        self.assertEqual([product.name for product in products], ["test1"])
+        products = Product.find_by_filters(high=90).order_by(Product.id).all()
+        self.assertEqual([product.name for product in products], ["test2", "test3"])
+        self.assertEqual(len(Product.find_by_filters().all()), 3)
+
+    def test_search(self):
+        """ Search products by name and description """
+        Product(name = "Red apple", description = "Crunchy and sweet", price = 1, inventory = 10, owner = "sun", category = "fruit").create()
+        Product(name = "Apple pie", description = "Baked with red apples", price = 9, inventory = 3, owner = "sun", category = "bakery").create()
+        Product(name = "Banana", description = "Yellow and sweet", price = 2, inventory = 8, owner = "ada", category = "fruit").create()
+        products = Product.search(Product.query, "apple").all()
+        self.assertEqual(sorted(product.name for product in products), ["Apple pie", "Red apple"])
+        products = Product.search(Product.query, "sweet").all()
+        self.assertEqual(sorted(product.name for product in products), ["Banana", "Red apple"])
+        products = Product.search(Product.find_by_filters(categories=["bakery"]), "red apple").all()
+        self.assertEqual([product.name for product in products], ["Apple pie"])
+        # the search index follows updates and deletes
+        product = Product.find(3)
+        product.description = "Yellow and ripe"
+        product.update()
+        Product.find(2).delete()
+        products = Product.search(Product.query, "sweet apple").all()
+        self.assertEqual([product.name for product in products], ["Red apple"])
+        self.assertEqual(Product.search(Product.query, 'quote" "chars').all(), [])
+
+    def test_search_not_autogenerated(self):
+        """ Keep autogenerate from dropping the full-text objects """
+        with db.engine.connect() as connection:
+            context = MigrationContext.configure(connection, opts={"include_object": include_object})
+            diffs = compare_metadata(context, db.metadata)
+        self.assertNotIn("search_vector", str(diffs))
+        self.assertNotIn("product_fts", str(diffs))
+
+    def test_version_server_default(self):
+        """ Default the version and write time of a raw INSERT """
+        db.session.execute(text(
+            "INSERT INTO product (id, name, description, price, inventory, owner, category) "
+            "VALUES (7, 'raw', 'inserted', 1, 1, 'sun', 'tools')"
+        ))
+        db.session.commit()
+        product = Product.find(7)
+        self.assertEqual(product.version, 1)
+        self.assertIsNotNone(product.updated_at)
+
+    def test_version(self):
+        """ Every write bumps a Product's version """
+        product = ProductFactory(inventory=10)
+        product.create()
+        self.assertEqual(product.version, 1)
+        product.category = "changed"
+        product.update()
+        self.assertEqual(product.version, 2)
+        self.assertEqual(Product.purchase(product.id, 1)["inventory"], 9)
+        db.session.expire_all()
+        self.assertEqual(Product.find(product.id).version, 3)
+
+    def test_update_if_version(self):
+        """ Update a Product only at the expected version """
+        product = ProductFactory()
+        product.create()
+        data = product.serialize()
+        data["name"] = "renamed"
+        self.assertIsNone(Product.update_if_version(product.id, data, 2))
+        updated = Product.update_if_version(product.id, data, 1)
+        self.assertEqual(updated["name"], "renamed")
+        self.assertEqual(updated["version"], 2)
+        self.assertIsNone(Product.update_if_version(product.id, data, 1))
+        self.assertIsNone(Product.update_if_version(0, data, 1))
+
+    def test_fingerprint(self):
+        """ The fingerprint of a page follows its rows """
+        for product in ProductFactory.create_batch(3):
+            product.create()
+
+        def page():
+            return Product.paginate(Product.select_fields(Product.query, ("id", "version")), 1, 2)
+
+        fingerprint = Product.fingerprint(page())
+        self.assertEqual(Product.fingerprint(page()), fingerprint)
+        product = Product.find(3)
+        product.description = "changed"
+        product.update()
+        self.assertNotEqual(Product.fingerprint(page()), fingerprint)
+        # a row that leaves the page changes it too
+        fingerprint = Product.fingerprint(page())
+        Product.find(2).delete()
+        self.assertNotEqual(Product.fingerprint(page()), fingerprint)
+
+    def test_select_fields(self):
+        """ Select only some fields of Products """
+        for product in ProductFactory.create_batch(2):
+            product.create()
+        rows = Product.select_fields(Product.query, ("id", "name")).order_by(Product.id).all()
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(len(rows[0]), 2)
+        self.assertEqual(rows[1].id, 2)
+
+    def test_paginate(self):
+        """ Page through Products by id """
+        for product in ProductFactory.create_batch(5):
+            product.create()
+        page = Product.paginate(Product.query, None, 2)
+        self.assertEqual([product.id for product in page], [1, 2])
+        page = Product.paginate(Product.query, page[-1].id, 10)
+        self.assertEqual([product.id for product in page], [3, 4, 5])
+
+    def test_create_many(self):
+        """ Create many Products in one transaction """
+        products = ProductFactory.create_batch(4)
+        Product.create_many(products)
+        self.assertEqual([product.id for product in products], [1, 2, 3, 4])
+        self.assertEqual(len(Product.all()), 4)
+        Product.create_many([])
+        self.assertEqual(len(Product.all()), 4)
+        # a failed batch is rolled back and leaves the session usable
+        products = ProductFactory.build_batch(2)
+        products[1].description = None
+        self.assertRaises(IntegrityError, Product.create_many, products)
+        self.assertEqual(len(Product.all()), 4)
+
+    def test_import_csv(self):
+        """ Import Products from CSV and report the rejected rows """
+        lines = io.StringIO(
+            "id,name,description,price,inventory,owner,category\n"
+            ",apple,red,1.5,10,bob,fruit\n"
+            ",pear,green,cheap,10,bob,fruit\n"
+            ",{},long,2,3,ann,fruit\n"
+            ",kiwi,brown,2,3,ann,fruit\n".format("x" * 64)
+        )
+        report = Product.import_csv(lines)
+        self.assertEqual(report["inserted"], 2)
+        self.assertEqual(report["rejected_count"], 2)
+        self.assertEqual([rejected["line"] for rejected in report["rejected"]], [3, 4])
+        self.assertIn("longer than 63", report["rejected"][1]["message"])
+        products = Product.all()
+        self.assertEqual([product.name for product in products], ["apple", "kiwi"])
+        self.assertEqual(products[0].price, 1.5)
+        self.assertEqual(products[0].version, 1)
+
+    def test_import_csv_upsert(self):
+        """ Update the Products with the same name and owner when importing """
+        ProductFactory(name="apple", owner="bob", inventory=1).create()
+        lines = io.StringIO(
+            "name,description,price,inventory,owner,category\n"
+            "apple,red,1.5,10,bob,fruit\n"
+            "apple,redder,1.7,12,bob,fruit\n"
+            "apple,green,1,1,ann,fruit\n"
+        )
+        report = Product.import_csv(lines, upsert=True, max_rejects=0)
+        # every row is counted once, the first apple of bob as a duplicate
+        self.assertEqual((report["inserted"], report["updated"], report["duplicates"]), (1, 1, 1))
+        product = Product.find(1)
+        self.assertEqual((product.description, product.inventory, product.version), ("redder", 12, 2))
+        self.assertEqual(Product.find_by_owner("ann").count(), 1)
+
+    def test_import_csv_blank_fields(self):
+        """ Keep empty owners and reject blank names when importing """
+        ProductFactory(name="apple", owner="", category="", inventory=1).create()
+        lines = io.StringIO(
+            "name,description,price,inventory,owner,category\n"
+            "apple,red,1.5,10,,\n"
+            " ,red,1.5,10,bob,fruit\n"
+        )
+        report = Product.import_csv(lines, upsert=True)
+        self.assertEqual((report["inserted"], report["updated"]), (0, 1))
+        self.assertIn("name is blank", report["rejected"][0]["message"])
+        products = Product.all()
+        self.assertEqual([(product.owner, product.category, product.inventory) for product in products],
+                         [("", "", 10)])
+
+    def test_import_csv_missing_columns(self):
+        """ Reject a CSV file without the Product columns """
+        lines = io.StringIO("name,price\napple,1\n")
+        self.assertRaises(DataValidationError, Product.import_csv, lines)
+
+    def test_validate_csv_row(self):
+        """ Validate and convert a row of a CSV file """
+        row = {"name": "apple", "description": "red", "price": "1.5",
+               "inventory": "10", "owner": "bob", "category": "fruit"}
+        data = Product.validate_csv_row(row)
+        self.assertEqual((data["price"], data["inventory"]), (1.5, 10))
+        for field, value in (("inventory", "1.5"), ("price", "nan"), ("inventory", str(2 ** 31)), ("owner", None)):
+            self.assertRaises(DataValidationError, Product.validate_csv_row, dict(row, **{field: value}))
+        row.pop("category")
+        self.assertRaises(DataValidationError, Product.validate_csv_row, row)
+
+    def test_validate_columns(self):
+        """ Check that the fields of a Product fit its columns """
+        data = ProductFactory().serialize()
+        self.assertEqual(Product.validate_columns(data), data)
+        for field, value in (("name", "x" * 64), ("inventory", -2 ** 31 - 1), ("price", float("inf"))):
+            self.assertRaises(DataValidationError, Product.validate_columns, dict(data, **{field: value}))
+
+    def test_stream_csv(self):
+        """ Stream a Product query as CSV with COPY TO """
+        if db.engine.dialect.name != "postgresql":
+            self.skipTest("COPY TO needs PostgreSQL")
+        for category in ("fruit", "vegetable", "fruit"):
+            ProductFactory(category=category).create()
+        chunks = list(Product.stream_csv(Product.find_by_category("fruit"), chunk_size=16))
+        self.assertGreater(len(chunks), 1)
+        lines = b"".join(chunks).decode("utf-8").splitlines()
+        self.assertEqual(lines[0], ",".join(PRODUCT_FIELDS))
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["1", "3"])
+        # a reader that stops early cancels COPY and frees its connection
+        for _ in range(20):
+            chunks = Product.stream_csv(Product.query, chunk_size=1)
+            next(chunks)
+            chunks.close()
+        self.assertEqual(len(Product.all()), 3)
+
+    def test_purchase(self):
+        """ Purchase from a Product's inventory """
+        product = ProductFactory(inventory=5)
+        product.create()
+        data = Product.purchase(product.id, 2)
+        self.assertEqual(data["id"], product.id)
+        self.assertEqual(data["inventory"], 3)
+        self.assertIsNone(Product.purchase(product.id, 4))
+        self.assertIsNone(Product.purchase(0, 1))
+        self.assertEqual(Product.find(product.id).inventory, 3)
+
+    def test_purchase_never_oversells(self):
+        """ Concurrent purchases never take inventory below zero """
+        product = ProductFactory(inventory=50)
+        product.create()
+        product_id = product.id
+
+        def buy(_):
+            with app.app_context():
+                return Product.purchase(product_id, 3) is not None
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            sold = sum(pool.map(buy, range(64)))
+        db.session.remove()
+        self.assertEqual(sold, 16)
+        self.assertEqual(Product.find(product_id).inventory, 50 - 3 * 16)
+
+    def test_checkout_overlapping_carts(self):
+        """ Concurrent overlapping carts all check out without deadlocking """
+        for _ in range(2):
+            ProductFactory(inventory=100).create()
+        carts = [[(1, 1), (2, 1)], [(2, 1), (1, 1)]] * 16
+
+        def checkout(cart):
+            with app.app_context():
+                return all(result["status"] == 200 for result in Product.checkout(cart))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            self.assertTrue(all(pool.map(checkout, carts)))
+        db.session.remove()
+        self.assertEqual(Product.find(1).inventory, 100 - 32)
+        self.assertEqual(Product.find(2).inventory, 100 - 32)
+
     def test_create_a_product(self):
         """ Test a product and assert that it exists """
         product = Product(name="apple", description = "good", price = 1.5, inventory = 100, owner = "sun123", category="fruit" )
@@ -245,3 +516,32 @@ class TestProduct(unittest.TestCase):
         data = "this is not a dictionary"
         product = Product()
         self.assertRaises(DataValidationError, product.deserialize, data)
+
+    def test_dispose_engine(self):
+        """ Reconnect after the engine is disposed in a forked worker """
+        product = ProductFactory()
+        product.create()
+        Product.find_serialized(product.id)
+        Product.dispose_engine()
+        self.assertIsNone(product_cache.get(product.id))
+        self.assertEqual(Product.find(product.id).name, product.name)
+
+    def test_warm_up(self):
+        """ Open the first pooled connection of a new worker """
+        Product.dispose_engine()
+        with patch.object(db.engine, "connect", wraps=db.engine.connect) as connect_mock:
+            Product.warm_up()
+        connect_mock.assert_called_once()
+
+    @patch("service.models.db.engine.connect", side_effect=InvalidRequestError("down"))
+    def test_warm_up_without_database(self, connect_mock):
+        """ A database that is down does not stop a worker from starting """
+        Product.warm_up()
+        connect_mock.assert_called_once()
+
+    def test_create_tables(self):
+        """ Create the tables when they are missing """
+        db.session.remove()
+        db.drop_all()
+        Product.create_tables()
+        self.assertEqual(Product.all(), [])
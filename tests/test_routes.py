@@ -7,17 +7,27 @@ Test cases can be run with the following:
 import os
 import json
 import logging
+import tempfile
+import subprocess
+import sys
+import csv
+import gzip
+import io
 from unittest import TestCase, mock
 from unittest.mock import patch
 from unittest.mock import MagicMock, patch
 from service import app, status  # HTTP Status Codes
-from service.models import db, Product, DataValidationError
-from service.routes import app, initialize_logging, init_db
+from service.models import db, Product, DataValidationError, product_cache
+from service.routes import initialize_logging, init_db, product_model, generate_apikey
+from flask_restx import marshal
 from .factories import ProductFactory
 from service.error_handlers import internal_server_error
+from service.admission import TokenBuckets
 from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm.exc import StaleDataError
 
 from urllib.parse import quote_plus
+from prometheus_client import REGISTRY
 
 
 ######################################################################
@@ -41,7 +51,7 @@ class TestProductServer(TestCase):
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
-        init_db()
+        init_db(app)
 
     @classmethod
     def tearDownClass(cls):
@@ -49,15 +59,17 @@ class TestProductServer(TestCase):
 
     def setUp(self):
         """ This runs before each test """
-        db.drop_all()  # clean up the last tests
-        db.create_all()  # make our sqlalchemy tables
+        with app.app_context():
+            db.drop_all()  # clean up the last tests
+            db.create_all()  # make our sqlalchemy tables
+            initialize_logging(logging.CRITICAL)
+        product_cache.clear()
         self.app = app.test_client()
-        initialize_logging(logging.CRITICAL)
 
     def tearDown(self):
         """ This runs after each test """
-        db.session.remove()
-        db.drop_all()
+        with app.app_context():
+            db.drop_all()
 
     def _create_products(self, count):
         """ Factory method to create products in bulk """
@@ -83,16 +95,173 @@ class TestProductServer(TestCase):
         resp = self.app.get("/")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertIn(b"Product Demo REST API Service", resp.data)
-    
+
+    def test_swagger_spec(self):
+        """ Serve the Swagger spec from memory with an ETag """
+        resp = self.app.get("/swagger.json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["info"]["title"], "Product Demo REST API Service")
+        self.assertIn("/products/{product_id}", resp.get_json()["paths"])
+        etag = resp.headers["ETag"]
+        self.assertEqual(self.app.get("/swagger.json").headers["ETag"], etag)
+        resp = self.app.get("/swagger.json", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+
+    def test_swagger_spec_gzip(self):
+        """ Serve the precompressed Swagger spec when gzip is accepted """
+        plain = self.app.get("/swagger.json")
+        resp = self.app.get("/swagger.json", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertNotEqual(resp.headers["ETag"], plain.headers["ETag"])
+        resp = self.app.get("/swagger.json", headers={"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_shed_reads_over_limit(self):
+        """ Answer 503 with Retry-After when every read slot is taken """
+        product = self._create_products(1)[0]
+        reads = app.extensions["admission"].limiters["reads"]
+        with patch.object(reads, "queue_timeout", 0.01):
+            for _ in range(reads.limit):
+                reads.acquire()
+            try:
+                resp = self.app.get("/products")
+                self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+                self.assertEqual(resp.headers["Retry-After"], str(app.config["RETRY_AFTER"]))
+                # purchases have slots of their own, and /metrics is never shed
+                resp = self.app.post("/products/{}/purchase".format(product.id),
+                                     json={"id": product.id, "amount": 1})
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(self.app.get("/metrics").status_code, status.HTTP_200_OK)
+            finally:
+                for _ in range(reads.limit):
+                    reads.release()
+        self.assertEqual(self.app.get("/products").status_code, status.HTTP_200_OK)
+
+    def test_release_slot_after_error(self):
+        """ Give the slot back when a request fails """
+        writes = app.extensions["admission"].limiters["writes"]
+        for _ in range(writes.limit + 1):
+            resp = self.app.post("/products", json={"name": "no description"})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(REGISTRY.get_sample_value("admission_in_flight", {"request_class": "writes"}), 0)
+
+    def test_rate_limit(self):
+        """ Answer 429 with Retry-After when a client runs out of tokens """
+        admission = app.extensions["admission"]
+        with patch.object(admission, "buckets", TokenBuckets(rate=1, burst=2)):
+            self.assertEqual(self.app.get("/products").status_code, status.HTTP_200_OK)
+            self.assertEqual(self.app.get("/products").status_code, status.HTTP_200_OK)
+            resp = self.app.get("/products")
+            self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(resp.headers["Retry-After"], "1")
+            # a made-up API key is still the same client
+            resp = self.app.get("/products", headers={"X-Api-Key": generate_apikey()})
+            self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            # the configured API key has a bucket of its own
+            with patch.dict(app.config, {"API_KEY": "secret"}):
+                resp = self.app.get("/products", headers={"X-Api-Key": "secret"})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_metrics(self):
+        """ Expose Prometheus metrics """
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        self.assertIn(b"db_pool_checkout_wait_seconds", resp.data)
+
+    def test_metrics_per_resource(self):
+        """ Record requests, latency, DB and serialization time per resource """
+        self._create_products(2)
+        labels = {"resource": "ProductCollection", "method": "GET", "status": "200"}
+        requests = REGISTRY.get_sample_value("http_requests_total", labels) or 0
+        serializations = REGISTRY.get_sample_value(
+            "http_request_serialization_seconds_count", {"resource": "ProductCollection"})
+        resp = self.app.get("/products")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(REGISTRY.get_sample_value("http_requests_total", labels), requests + 1)
+        self.assertEqual(REGISTRY.get_sample_value(
+            "http_request_serialization_seconds_count", {"resource": "ProductCollection"}), serializations + 1)
+        self.assertGreater(REGISTRY.get_sample_value(
+            "http_request_db_seconds_sum", {"resource": "ProductCollection"}), 0)
+        resp = self.app.get("/products/0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertGreaterEqual(REGISTRY.get_sample_value(
+            "http_requests_total", {"resource": "ProductResource", "method": "GET", "status": "404"}), 1)
+        resp = self.app.post("/products/1/purchase", json={"amount": 1})
+        self.assertGreaterEqual(REGISTRY.get_sample_value(
+            "http_request_duration_seconds_count", {"resource": "PurchaseResource", "method": "POST"}), 1)
+
+    def test_query_stats_headers(self):
+        """ Send the SQL statement count and timings of a request """
+        test_product = self._create_products(1)[0]
+        url = "/products/{}".format(test_product.id)
+        resp = self.app.get(url)
+        self.assertEqual(resp.headers["X-Query-Count"], "1")
+        self.assertIn('db;desc="SQL";dur=', resp.headers["Server-Timing"])
+        resp = self.app.get(url)
+        self.assertEqual(resp.headers["X-Query-Count"], "0")
+        app.testing = False
+        try:
+            resp = self.app.get(url)
+        finally:
+            app.testing = True
+        self.assertNotIn("X-Query-Count", resp.headers)
+        self.assertNotIn("Server-Timing", resp.headers)
+        # the queries of a streamed export run after the headers are sent
+        resp = self.app.get("/products/export", headers={"Accept": "text/csv"})
+        self.assertTrue(resp.is_streamed)
+        self.assertNotIn("X-Query-Count", resp.headers)
+
+    def test_query_budget(self):
+        """ Warn when a request issues more SQL statements than its budget """
+        self._create_products(3)
+        with patch.dict(app.config, {"QUERY_BUDGET": 0}):
+            with self.assertLogs(app.logger, level="WARNING") as logs:
+                self.app.get("/products")
+        self.assertIn("over the budget of 0", logs.output[0])
+
+    def test_n_plus_one_warning(self):
+        """ Warn when a request repeats the same SQL statement """
+        with app.app_context():
+            for _ in range(3):
+                ProductFactory(inventory=5).create()
+        cart = [{"id": product_id, "amount": 1} for product_id in (1, 2, 3)]
+        with patch.dict(app.config, {"N_PLUS_ONE_THRESHOLD": 3}):
+            with self.assertLogs(app.logger, level="WARNING") as logs:
+                resp = self.app.post("/products/checkout", json=cart)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(any("possible N+1 query" in line for line in logs.output))
+
+    def test_metrics_multiprocess(self):
+        """ Merge the metrics files of the gunicorn workers """
+        with tempfile.TemporaryDirectory() as directory:
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn(b"http_requests_total", resp.data)
+
     @mock.patch('service.routes.init_db', side_effect=Exception())
     def test_init_exception(self, service_init_mock):
-        import service
-        import importlib
+        from service import create_app
         with self.assertRaises(SystemExit) as cm:
-            importlib.import_module("service")
-            self.assertRaises(Exception, importlib.reload, service)
+            create_app()
         self.assertEqual(cm.exception.code, 4)
-        # self.assertRaises(Exception, importlib.reload, "service")
+
+    def test_session_removed_after_request(self):
+        """ Tear the database session down at the end of every request """
+        self._create_products(1)
+        self.assertEqual(self.app.get("/products").status_code, status.HTTP_200_OK)
+        self.assertFalse(db.session.registry.has())
+
+    def test_import_has_no_side_effects(self):
+        """ Importing the service builds no app and loads no routes """
+        code = "import sys, service; print(sorted(m for m in sys.modules if m.startswith(('service', 'alembic'))))"
+        output = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE).stdout
+        self.assertEqual(output.strip(), b"['service']")
 
     def test_get_product_list(self):
         """ Get a list of Products """
@@ -102,6 +271,246 @@ class TestProductServer(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_get_product_list_matches_product_model(self):
+        """ The list fast path returns exactly what marshalling would """
+        products = self._create_products(3)
+        resp = self.app.get("/products")
+        self.assertEqual(resp.content_type, "application/json")
+        for product, data in zip(products, resp.get_json()):
+            self.assertEqual(data, json.loads(json.dumps(marshal(product.serialize(), product_model))))
+
+    def test_get_product_list_sparse_fields(self):
+        """ Get only some fields of the Products in the list """
+        self._create_products(3)
+        resp = self.app.get("/products", query_string="fields=name,price&limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 2)
+        for product in data:
+            self.assertEqual(set(product), {"id", "name", "price"})
+        resp = self.app.get("/products", query_string={"fields": "name", "limit": 2, "cursor": resp.headers["X-Next-Cursor"]})
+        self.assertEqual(resp.get_json()[0]["id"], 3)
+
+    def test_get_product_sparse_fields(self):
+        """ Get only some fields of a single Product """
+        test_product = self._create_products(1)[0]
+        url = "/products/{}".format(test_product.id)
+        full_etag = self.app.get(url).headers["ETag"]
+        resp = self.app.get(url, query_string="fields=inventory")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"id": test_product.id, "inventory": test_product.inventory})
+        self.assertNotEqual(resp.headers["ETag"], full_etag)
+
+    def test_get_sparse_fields_unknown(self):
+        """ Ask for a field that Products do not have """
+        resp = self.app.get("/products", query_string="fields=name,secret")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/products/1", query_string="fields=version")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_product_facets(self):
+        """ Get facets of the Products that match the filters """
+        with app.app_context():
+            for price, category, owner in ((1, "fruit", "sun"), (3, "fruit", "ada"), (9, "pet", "sun"), (5, "fruit", "sun")):
+                Product(name="p", description="d", price=price, inventory=1, owner=owner, category=category).create()
+        resp = self.app.get("/products/facets", query_string="buckets=4")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        facets = resp.get_json()
+        self.assertEqual(facets["count"], 4)
+        self.assertEqual(facets["price"], {"min": 1, "max": 9, "avg": 4.5})
+        self.assertEqual(facets["categories"], [{"value": "fruit", "count": 3}, {"value": "pet", "count": 1}])
+        self.assertEqual(facets["owners"][0], {"value": "sun", "count": 3})
+        self.assertEqual([bucket["count"] for bucket in facets["histogram"]], [1, 1, 1, 1])
+        self.assertEqual(facets["histogram"][-1], {"low": 7, "high": 9, "count": 1})
+        resp = self.app.get("/products/facets", query_string="category=fruit&buckets=2")
+        facets = resp.get_json()
+        self.assertEqual(facets["count"], 3)
+        self.assertEqual([bucket["count"] for bucket in facets["histogram"]], [1, 2])
+
+    def test_get_product_facets_edge_cases(self):
+        """ Get facets with no matches, a single price or bad arguments """
+        facets = self.app.get("/products/facets").get_json()
+        self.assertEqual(facets["count"], 0)
+        self.assertEqual(facets["histogram"], [])
+        with app.app_context():
+            Product(name="p", description="d", price=2, inventory=1, owner="sun", category="fruit").create()
+        facets = self.app.get("/products/facets").get_json()
+        self.assertEqual(facets["histogram"], [{"low": 2, "high": 2, "count": 1}])
+        resp = self.app.get("/products/facets", query_string="buckets=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/products/facets", query_string="facet_limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        for arg in ("buckets", "facet_limit"):
+            resp = self.app.get("/products/facets", query_string={arg: "abc"})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_product_list_paginated(self):
+        """ Page through the Product list with a cursor """
+        self._create_products(5)
+        resp = self.app.get("/products", query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        first_page = resp.get_json()
+        self.assertEqual(len(first_page), 2)
+        self.assertIn('rel="next"', resp.headers["Link"])
+        cursor = resp.headers["X-Next-Cursor"]
+        resp = self.app.get("/products", query_string={"limit": 2, "cursor": cursor})
+        second_page = resp.get_json()
+        self.assertEqual(len(second_page), 2)
+        self.assertGreater(second_page[0]["id"], first_page[-1]["id"])
+        resp = self.app.get("/products", query_string={"limit": 2, "cursor": resp.headers["X-Next-Cursor"]})
+        self.assertEqual(len(resp.get_json()), 1)
+        self.assertNotIn("Link", resp.headers)
+
+    def test_get_product_list_max_page_size(self):
+        """ The page size is capped at the server maximum """
+        self._create_products(4)
+        with patch.dict(app.config, {"MAX_PAGE_SIZE": 3}):
+            resp = self.app.get("/products", query_string="limit=100")
+            self.assertEqual(len(resp.get_json()), 3)
+            resp = self.app.get("/products")
+            self.assertEqual(len(resp.get_json()), 3)
+
+    def test_get_product_list_bad_page_args(self):
+        """ Reject an invalid cursor or page size """
+        resp = self.app.get("/products", query_string="cursor=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/products", query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/products", query_string="limit=abc")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("limit must be an integer", resp.get_json()["message"])
+
+    def test_export_products_ndjson(self):
+        """ Export the catalog as NDJSON """
+        products = self._create_products(3)
+        resp = self.app.get("/products/export", headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])["name"], products[0].name)
+
+    def test_export_products_csv(self):
+        """ Export the catalog as CSV """
+        self._create_products(3)
+        resp = self.app.get("/products/export", headers={"Accept": "text/csv"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "text/csv")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith("id,name,description"))
+
+    def test_export_products_filtered_gzip(self):
+        """ Export only the filtered Products, gzip compressed """
+        with app.app_context():
+            for category in ("fruit", "vegetable", "fruit"):
+                ProductFactory(category=category).create()
+        resp = self.app.get("/products/export", query_string="category=fruit",
+                            headers={"Accept": "text/csv", "Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(resp.get_data()).decode("utf-8"))))
+        self.assertEqual([row["id"] for row in rows], ["1", "3"])
+        self.assertEqual({row["category"] for row in rows}, {"fruit"})
+        resp = self.app.get("/products/export", query_string="low=cheap", headers={"Accept": "text/csv"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_products_no_accept(self):
+        """ Export the catalog as NDJSON when Accept is missing """
+        self._create_products(2)
+        resp = self.app.get("/products/export")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertEqual(len(resp.get_data(as_text=True).splitlines()), 2)
+
+    def test_export_products_not_acceptable(self):
+        """ Export the catalog in an unsupported media type """
+        resp = self.app.get("/products/export", headers={"Accept": "application/xml"})
+        self.assertEqual(resp.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
+    def test_create_products_batch(self):
+        """ Create a batch of Products in one request """
+        payload = [ProductFactory().serialize() for _ in range(5)]
+        resp = self.app.post("/products:batch", json=payload, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        results = resp.get_json()
+        self.assertEqual(len(results), 5)
+        for index, result in enumerate(results):
+            self.assertEqual(result["index"], index)
+            self.assertEqual(result["status"], status.HTTP_201_CREATED)
+            resp = self.app.get("/products/{}".format(result["id"]))
+            self.assertEqual(resp.get_json()["name"], payload[index]["name"])
+
+    def test_create_products_batch_partial(self):
+        """ Create a batch of Products with some invalid items """
+        payload = [ProductFactory().serialize() for _ in range(3)]
+        payload[1].pop("name")
+        resp = self.app.post("/products:batch", json=payload, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        results = resp.get_json()
+        self.assertEqual([result["status"] for result in results], [201, 400, 201])
+        self.assertIn("name", results[1]["message"])
+        with app.app_context():
+            self.assertEqual(len(Product.all()), 2)
+
+    def test_create_products_batch_columns(self):
+        """ Reject the items of a batch that do not fit the columns """
+        payload = [ProductFactory().serialize() for _ in range(3)]
+        payload[0]["name"] = "x" * 64
+        payload[2]["inventory"] = 2 ** 31
+        resp = self.app.post("/products:batch", json=payload, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        results = resp.get_json()
+        self.assertEqual([result["status"] for result in results], [400, 201, 400])
+        self.assertIn("longer than 63", results[0]["message"])
+        with app.app_context():
+            self.assertEqual(len(Product.all()), 1)
+
+    def test_create_products_batch_bad_data(self):
+        """ Create a batch of Products with bad data """
+        resp = self.app.post("/products:batch", json={}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/products:batch", json=[{}], content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        with patch.dict(app.config, {"MAX_BATCH_SIZE": 1}):
+            resp = self.app.post("/products:batch", json=[{}, {}], content_type="application/json")
+            self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_import_products(self):
+        """ Import Products from a CSV upload """
+        app.config["API_KEY"] = generate_apikey()
+        headers = {"X-Api-Key": app.config["API_KEY"]}
+        body = "name,description,price,inventory,owner,category\napple,red,1.5,10,bob,fruit\n"
+        resp = self.app.post("/products:import", data=body, content_type="text/csv; charset=utf-8", headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json()["inserted"], 1)
+        body += "apple,redder,2,10,bob,fruit\npear,green,free,1,bob,fruit\n"
+        resp = self.app.post("/products:import?mode=upsert", data=body, content_type="text/csv", headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        report = resp.get_json()
+        self.assertEqual((report["inserted"], report["updated"], report["rejected_count"]), (0, 1, 1))
+        self.assertEqual(report["rejected"][0]["line"], 4)
+        self.assertEqual(self.app.get("/products/1").get_json()["description"], "redder")
+        resp = self.app.post("/products:import", data=body.splitlines()[0] + "\npear,green,free,1,bob,fruit\n",
+                             content_type="text/csv", headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_products_bad_requests(self):
+        """ Reject imports without a key, as the wrong type or without the columns """
+        app.config["API_KEY"] = generate_apikey()
+        body = "name,price\napple,1\n"
+        resp = self.app.post("/products:import", data=body, content_type="text/csv")
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+        resp = self.app.post("/products:import", data=body, content_type="text/csv", headers={"X-Api-Key": "wrong"})
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+        headers = {"X-Api-Key": app.config["API_KEY"]}
+        resp = self.app.post("/products:import", data=body, content_type="text/plain", headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        resp = self.app.post("/products:import", data=body, content_type="text/csv", headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/products:import?mode=merge", data=body, content_type="text/csv", headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_product(self):
         """ Get a single product """
         # get the id of a product
@@ -116,6 +525,64 @@ class TestProductServer(TestCase):
         # print the repr of a product
         rep = "%s" % test_product
 
+    def test_get_product_cached(self):
+        """ Get a single product from the cache until it changes """
+        test_product = self._create_products(1)[0]
+        url = "/products/{}".format(test_product.id)
+        self.app.get(url)
+        with patch('service.models.Product.find') as find:
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["name"], test_product.name)
+            find.assert_not_called()
+        self.assertEqual(product_cache.stats()["hits"], 1)
+        data = resp.get_json()
+        data["name"] = "renamed"
+        self.app.put(url, json=data, content_type="application/json")
+        self.assertEqual(self.app.get(url).get_json()["name"], "renamed")
+        self.app.delete(url)
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_product_not_modified(self):
+        """ Get a single product conditionally with its ETag """
+        test_product = self._create_products(1)[0]
+        url = "/products/{}".format(test_product.id)
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(len(resp.data), 0)
+        data = self.app.get(url).get_json()
+        data["category"] = "changed"
+        resp = self.app.put(url, json=data, content_type="application/json")
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["category"], "changed")
+
+    def test_get_product_list_not_modified(self):
+        """ Get the Product list conditionally with its ETag """
+        with app.app_context():
+            for _ in range(3):
+                ProductFactory(inventory=10).create()
+        resp = self.app.get("/products", query_string="limit=2")
+        etag = resp.headers["ETag"]
+        # the tag comes from the page itself, not from a scan of the whole list
+        self.assertEqual(resp.headers["X-Query-Count"], "1")
+        resp = self.app.get("/products", query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        # a different page of the same list has its own tag
+        resp = self.app.get("/products", query_string="limit=1", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # so does the list after any change to a product in it
+        self.app.post("/products/3/purchase", json={"id": 3, "amount": 1}, content_type="application/json")
+        resp = self.app.get("/products", query_string="limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.app.delete("/products/3")
+        resp = self.app.get("/products", query_string="limit=2", headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
     def test_get_product_not_found(self):
         """Get a Product thats not found"""
         resp = self.app.get("/products/0")
@@ -144,6 +611,61 @@ class TestProductServer(TestCase):
         self.assertEqual(updated_product["category"], "Education")
 
 
+    def test_update_product_if_match(self):
+        """ Update a Product only if it still matches its ETag """
+        test_product = self._create_products(1)[0]
+        url = "/products/{}".format(test_product.id)
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+        data["category"] = "first"
+        resp = self.app.put(url, json=data, headers={"If-Match": etag}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["category"], "first")
+        new_etag = resp.headers["ETag"]
+        self.assertNotEqual(new_etag, etag)
+        # a second editor still holding the old ETag is rejected
+        data["category"] = "second"
+        resp = self.app.put(url, json=data, headers={"If-Match": etag}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json()["category"], "first")
+        self.assertEqual(resp.headers["ETag"], new_etag)
+
+    def test_update_product_if_match_sparse(self):
+        """ Update a Product with the ETag of some of its fields """
+        test_product = self._create_products(1)[0]
+        url = "/products/{}".format(test_product.id)
+        etag = self.app.get(url, query_string="fields=id,name").headers["ETag"]
+        data = self.app.get(url).get_json()
+        data["category"] = "first"
+        resp = self.app.put(url, json=data, headers={"If-Match": etag}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # the sparse ETag of the old version is stale too
+        resp = self.app.put(url, json=data, headers={"If-Match": etag}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_update_product_if_match_errors(self):
+        """ Update a Product with an If-Match that cannot match """
+        test_product = self._create_products(1)[0]
+        data = test_product.serialize()
+        resp = self.app.put("/products/0", json=data, headers={"If-Match": '"0-1"'}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        url = "/products/{}".format(test_product.id)
+        resp = self.app.put(url, json=data, headers={"If-Match": '"garbage"'}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        data.pop("name")
+        resp = self.app.put(url, json=data, headers={"If-Match": '"{}-1"'.format(test_product.id)}, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_product_concurrent_change(self):
+        """ Update a Product that another request changed first """
+        test_product = self._create_products(1)[0]
+        data = test_product.serialize()
+        with patch('service.models.Product.update', side_effect=StaleDataError):
+            resp = self.app.put("/products/{}".format(test_product.id), json=data, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
     def test_update_product_not_found(self):
         """ Update a product that's not found """
         test_product = ProductFactory()
@@ -167,22 +689,85 @@ class TestProductServer(TestCase):
     def test_delete_a_product_commit_error(self):
         """ Delete a Product """
         product = Product(name="iPhone X", description="Black iPhone", category="Technology", price=999.99)
-        product.create()
-        self.assertEqual(len(Product.all()), 1)
-        # delete the product and make sure it isn't in the database
-        with patch('service.models.db.session.commit') as commit:
-            commit.side_effect = InvalidRequestError
-            product.delete()
+        with app.app_context():
+            product.create()
             self.assertEqual(len(Product.all()), 1)
+            # delete the product and make sure it isn't in the database
+            with patch('service.models.db.session.commit') as commit:
+                commit.side_effect = InvalidRequestError
+                product.delete()
+                self.assertEqual(len(Product.all()), 1)
 
     def test_purchase_a_product(self):
         """Purchase a product"""
-        self._create_products(2)
+        with app.app_context():
+            for _ in range(2):
+                ProductFactory(inventory=10).create()
         purchase_model = {"id": 2, "amount": 1}
         resp = self.app.post("/products/2/purchase", json=purchase_model, content_type="application/json")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         resp = self.app.get("/products/2", content_type="application/json")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["inventory"], 9)
+
+    def test_purchase_insufficient_inventory(self):
+        """Purchase more of a product than is in inventory"""
+        with app.app_context():
+            ProductFactory(inventory=3).create()
+        purchase_model = {"id": 1, "amount": 4}
+        resp = self.app.post("/products/1/purchase", json=purchase_model, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.get("/products/1", content_type="application/json")
+        self.assertEqual(resp.get_json()["inventory"], 3)
+
+    def test_purchase_bad_amount(self):
+        """Purchase a non-positive amount of a product"""
+        with app.app_context():
+            ProductFactory(inventory=3).create()
+        purchase_model = {"id": 1, "amount": 0}
+        resp = self.app.post("/products/1/purchase", json=purchase_model, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_checkout_a_cart(self):
+        """Checkout several products at once"""
+        with app.app_context():
+            for inventory in (5, 7):
+                ProductFactory(inventory=inventory).create()
+        cart = [{"id": 2, "amount": 3}, {"id": 1, "amount": 5}, {"id": 2, "amount": 1}]
+        resp = self.app.post("/products/checkout", json=cart, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()
+        self.assertEqual([result["status"] for result in results], [200, 200, 200])
+        self.assertEqual(results[1]["inventory"], 0)
+        with app.app_context():
+            self.assertEqual(Product.find(2).inventory, 3)
+
+    def test_checkout_is_all_or_nothing(self):
+        """Checkout a cart with a line that cannot be purchased"""
+        with app.app_context():
+            ProductFactory(inventory=5).create()
+        cart = [{"id": 1, "amount": 2}, {"id": 1, "amount": 4}, {"id": 9, "amount": 1}]
+        resp = self.app.post("/products/checkout", json=cart, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        results = resp.get_json()
+        self.assertEqual([result["status"] for result in results], [409, 409, 404])
+        with app.app_context():
+            self.assertEqual(Product.find(1).inventory, 5)
+            ProductFactory(inventory=5).create()
+        cart = [{"id": 2, "amount": 1}, {"id": 1, "amount": 6}]
+        resp = self.app.post("/products/checkout", json=cart, content_type="application/json")
+        results = resp.get_json()
+        self.assertEqual([result["status"] for result in results], [424, 409])
+        with app.app_context():
+            self.assertEqual(Product.find(2).inventory, 5)
+
+    def test_checkout_bad_cart(self):
+        """Checkout an empty or invalid cart"""
+        resp = self.app.post("/products/checkout", json=[], content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        cart = [{"id": 1, "amount": -1}]
+        resp = self.app.post("/products/checkout", json=cart, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_purchase_not_available(self):
         """Purchase a product that is not available"""
@@ -226,7 +811,8 @@ class TestProductServer(TestCase):
 
     def test_internal_server_error(self):
         '''Internal Server Error '''
-        resp = internal_server_error("internal serval error")
+        with app.app_context():
+            resp = internal_server_error("internal serval error")
         self.assertEqual(resp[1], status.HTTP_500_INTERNAL_SERVER_ERROR)
         
     def test_query_product_list_by_name(self):
@@ -291,6 +877,68 @@ class TestProductServer(TestCase):
         for product in data:
             self.assertEqual(product["category"], test_category)
 
+    def test_query_product_list_by_several_filters(self):
+        """ Query Products by several filters at once """
+        products = self._create_products(20)
+        test_category = products[0].category
+        matches = [product for product in products if product.category == test_category and product.price >= 20]
+        resp = self.app.get(
+            "/products", query_string={"category": test_category, "low": 20}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), len(matches))
+        for product in data:
+            self.assertEqual(product["category"], test_category)
+            self.assertTrue(product["price"] >= 20)
+
+    def test_query_product_list_by_any_of_several(self):
+        """ Query Products matching any of several names below a price """
+        products = self._create_products(20)
+        names = ["apple", "banana"]
+        matches = [product for product in products if product.name in names and product.price <= 30]
+        resp = self.app.get(
+            "/products", query_string=[("name", "apple"), ("name", "banana"), ("high", "30")]
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), len(matches))
+        for product in data:
+            self.assertIn(product["name"], names)
+            self.assertTrue(product["price"] <= 30)
+
+    def test_search_product_list(self):
+        """ Search Products and page through the matches """
+        with app.app_context():
+            for index in range(5):
+                Product(name="Widget {}".format(index), description="A blue widget", price=index,
+                        inventory=1, owner="sun", category="tools").create()
+            Product(name="Gadget", description="Nothing to see", price=1, inventory=1, owner="sun", category="tools").create()
+        resp = self.app.get("/products", query_string={"q": "blue widget", "limit": 3})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        first_page = resp.get_json()
+        self.assertEqual(len(first_page), 3)
+        resp = self.app.get("/products", query_string={"q": "blue widget", "limit": 3, "cursor": resp.headers["X-Next-Cursor"]})
+        second_page = resp.get_json()
+        self.assertEqual(len(second_page), 2)
+        self.assertNotIn("Link", resp.headers)
+        names = {product["name"] for product in first_page + second_page}
+        self.assertEqual(names, {"Widget {}".format(index) for index in range(5)})
+
+    def test_search_product_list_blank(self):
+        """ Ignore a search of only whitespace """
+        self._create_products(3)
+        for path in ("/products", "/products/facets"):
+            resp = self.app.get(path, query_string={"q": "  "})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get("/products", query_string={"q": " "})
+        self.assertEqual(len(resp.get_json()), 3)
+
+    def test_query_product_list_bad_price(self):
+        """ Query Products with a price that is not a number """
+        resp = self.app.get("/products", query_string="low=cheap")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_create_product(self):
             """ Create a new Product """
             test_product = ProductFactory()
@@ -0,0 +1,60 @@
+"""
+Test cases for the Product Serializers
+"""
+import gzip
+import json
+import unittest
+from unittest.mock import patch
+from service import serializers
+from service.serializers import EncodedBody, RowSerializer
+
+
+######################################################################
+#  R O W   S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestRowSerializer(unittest.TestCase):
+    """ Test Cases for RowSerializer """
+
+    def test_to_dicts(self):
+        """ Turn row tuples into dictionaries """
+        serializer = RowSerializer(["id", "name", "price"])
+        rows = [(1, "apple", 1.5), (2, "pear", None)]
+        self.assertEqual(
+            serializer.to_dicts(rows),
+            [{"id": 1, "name": "apple", "price": 1.5}, {"id": 2, "name": "pear", "price": None}],
+        )
+
+    def test_dumps(self):
+        """ Turn row tuples into JSON bytes """
+        serializer = RowSerializer(["id", "name"])
+        body = serializer.dumps([(1, "café")])
+        self.assertIsInstance(body, bytes)
+        self.assertEqual(json.loads(body), [{"id": 1, "name": "café"}])
+
+    def test_dumps_without_orjson(self):
+        """ Fall back to the standard library encoder """
+        with patch.object(serializers, "orjson", None):
+            body = serializers.dumps({"name": "café", "price": 1.5})
+        self.assertEqual(json.loads(body.decode("utf-8")), {"name": "café", "price": 1.5})
+
+
+######################################################################
+#  E N C O D E D   B O D Y   T E S T   C A S E S
+######################################################################
+class TestEncodedBody(unittest.TestCase):
+    """ Test Cases for EncodedBody """
+
+    def test_encode_once(self):
+        """ Keep the JSON, a gzipped copy and an etag """
+        encoded = EncodedBody({"name": "café", "paths": ["/products"]})
+        self.assertEqual(json.loads(encoded.body), {"name": "café", "paths": ["/products"]})
+        self.assertEqual(gzip.decompress(encoded.gzipped), encoded.body)
+        self.assertEqual(len(encoded.etag), 40)
+
+    def test_etag_ignores_key_order(self):
+        """ The same document has the same etag in every worker """
+        first = EncodedBody({"a": 1, "b": {"c": 2, "d": 3}})
+        second = EncodedBody({"b": {"d": 3, "c": 2}, "a": 1})
+        self.assertEqual(first.body, second.body)
+        self.assertEqual(first.etag, second.etag)
+        self.assertEqual(first.gzipped, second.gzipped)